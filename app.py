@@ -10,20 +10,25 @@ a twitter feed.
 
 import sys
 import logging
-import numpy as np
+import threading
 from select import select
 
-from lib import okcupid, models
-from lib.twitter import SortedTweeterator
-from lib.settings import Settings
-from lib.database import db, get_or_create, init_db
+# SQLAlchemy (lib.database, lib.models and everything that queries through
+# them) and numpy (lib.twitter, lib.seen) take most of a second to import,
+# so they're imported in the functions that need them. That way the bot
+# can start logging in before they've loaded.
+from lib import okcupid, metrics
+from lib.ratelimit import TokenBucket
+from lib.scraper import ScrapePool
+from lib.veto import VetoQueue, Sender
+from lib.tumblr.tumblr import TumblrSource
 
 ##############################################################################
 # Globals
 ##############################################################################
 
-init_db()
-SETTINGS = Settings('settings.yml')
+# loaded by `startup`
+SETTINGS = None
 
 # time to wait after annoucing a response so that a console user can
 # veto it.
@@ -36,21 +41,105 @@ logging.basicConfig(level=logging.INFO)
 ##############################################################################
 
 
+def startup(settings_fn='settings.yml'):
+    """Load the settings. Nothing happens on import, so that importing this
+    (e.g. for the benchmarks) is cheap; the database is brought up to date
+    by `main`, once the login is under way."""
+    global SETTINGS
+    from lib.settings import Settings
+    SETTINGS = Settings(settings_fn)
+
+
 def setup():
     """Load up an OkCupid object and a Tweeterator object, pulling startup info
     from the settings dict.
     """
-    cupidbot = okcupid.OkCupid(SETTINGS.okcupid['username'],
-                      SETTINGS.okcupid['password'])
-    twitterstream = SortedTweeterator(app_key=SETTINGS.twitter['consumer_key'],
-                                 app_secret=SETTINGS.twitter['consumer_secret'],
-                                 oauth_token=SETTINGS.twitter['access_key'],
-                                 oauth_token_secret=SETTINGS.twitter['access_secret'],
-                                 tweet_id_fn=SETTINGS.tweet_id_fn)
-    return cupidbot, twitterstream
+    return make_bot(SETTINGS.okcupid, make_limiter()), setup_tweets()
+
+
+def make_limiter():
+    "The rate limiter for everything that talks to the site"
+    return TokenBucket(rate=SETTINGS.okcupid.get('requests_per_second', 1.0),
+                       burst=SETTINGS.okcupid.get('request_burst', 1))
+
+
+def make_bot(account, limiter):
+    """An OkCupid object for one account
+
+    Parameters
+    ----------
+    account : dict
+        The 'username' and 'password', and optionally the 'browser' and
+        'base_url', like the `okcupid` setting
+    limiter : ratelimit.TokenBucket
+    """
+    return okcupid.OkCupid(account['username'], account['password'],
+                           browser=account.get('browser', 'chrome'),
+                           base_url=account.get('base_url', okcupid.BASE_URL),
+                           limiter=limiter)
+
 
+def setup_tweets():
+    """Load up the Tweeterator, pulling startup info from the settings dict.
 
-def respond_to_messages(cupidbot, twitterstream):
+    The `tweet_source` setting picks where tweets come from: 'twitter' (the
+    default) pulls from the API, recording everything in the local corpus
+    and warm-starting from it; 'corpus' serves only from the local corpus;
+    anything else is taken as the filename of a JSONL fixture.
+
+    If the `tumblr` setting has a 'blog_url', the posts on that blog are
+    merged in too, through their own corpus in the `tumblr_posts` table.
+
+    The `scorer` setting picks how tweets are ranked against a message (see
+    `twitter.SCORERS`), and `tweet_buffer_size` how many are kept to choose
+    from.
+    """
+    from lib import models
+    from lib.twitter import SortedTweeterator
+    from lib.corpus import TweetCorpus, JSONLSource
+    from lib.database import db
+
+    corpus = TweetCorpus(db)
+    scorer = getattr(SETTINGS, 'scorer', 'levenshtein')
+    buffer_size = getattr(SETTINGS, 'tweet_buffer_size',
+                          SortedTweeterator.ideal_buffer_len)
+    tweet_source = getattr(SETTINGS, 'tweet_source', 'twitter')
+    if tweet_source == 'twitter':
+        twitterstream = SortedTweeterator(app_key=SETTINGS.twitter['consumer_key'],
+                                     app_secret=SETTINGS.twitter['consumer_secret'],
+                                     oauth_token=SETTINGS.twitter['access_key'],
+                                     oauth_token_secret=SETTINGS.twitter['access_secret'],
+                                     tweet_id_fn=SETTINGS.tweet_id_fn,
+                                     corpus=corpus, scorer=scorer)
+        twitterstream.ideal_buffer_len = buffer_size
+        twitterstream.warm_start(corpus, buffer_size)
+    else:
+        if tweet_source == 'corpus':
+            source = corpus
+        else:
+            source = JSONLSource(tweet_source)
+        twitterstream = SortedTweeterator(tweet_id_fn=SETTINGS.tweet_id_fn,
+                                          source=source, scorer=scorer)
+        twitterstream.ideal_buffer_len = buffer_size
+
+    tumblr = getattr(SETTINGS, 'tumblr', {})
+    if 'blog_url' in tumblr:
+        source = TumblrSource(tumblr['blog_url'],
+                              app_key=tumblr['consumer_key'],
+                              app_secret=tumblr['consumer_secret'],
+                              oauth_token=tumblr['oauth_token'],
+                              oauth_token_secret=tumblr['oauth_secret'])
+        posts = TweetCorpus(db, models.TumblrPost)
+        feed = twitterstream.add_source('tumblr', source, corpus=posts)
+        twitterstream.warm_start(posts, len(twitterstream.buffer) +
+                                 buffer_size // 2, feed=feed)
+
+    if getattr(SETTINGS, 'prefetch_tweets', False):
+        twitterstream.start_prefetch()
+    return twitterstream
+
+
+def respond_to_messages(cupidbot, twitterstream, pool=None, vetoes=None):
     """Respond to all of the unreplied messages on the cupidbot with an
     entry from the twitterstream
 
@@ -63,82 +152,267 @@ def respond_to_messages(cupidbot, twitterstream):
         An iterator that provides the text of tweets as a stream. Also needs
         to have a `pull` method asking it to load up some more tweets into
         its buffer
+    pool : scraper.ScrapePool, optional
+        Workers to scrape the threads with, concurrently
+    vetoes : veto.VetoQueue or veto.Sender, optional
+        If given, each thread's reply is proposed as soon as the thread has
+        been logged, and the veto windows and sending overlap with the
+        scraping of the rest. Otherwise the threads are replied to one at a
+        time, each waiting out its own `PROMPT_TIMEOUT`.
     """
 
-    threads = cupidbot.get_threads(['unreadMessage', 'readMessage'])
+    summaries = cupidbot.get_thread_summaries(['unreadMessage', 'readMessage'])
+    threads = [tid for tid, digest in summaries]
+    digests = dict(summaries)
     logging.info('Replying to %s', threads)
 
     logging.info('number of unreplied messages: %d', len(threads))
-    twitterstream.pull(len(threads))
-    for tid in threads:
-        log_threads(cupidbot, [tid])
-        thread = db.query(models.Thread).filter_by(okc_id=tid).first()
-        target = thread.messages[-1].body
-
-        get_tweet = True
-
-        while get_tweet:
-            response = twitterstream.next(target=target)
-            try:
-                print 'RESPONDING WITH: "%s"' % response
-            except UnicodeEncodeError:
-                print 'Unicode error. Getting new tweet'
-                continue
+    if twitterstream.prefetcher is None:
+        twitterstream.pull(len(threads))
+
+    if vetoes is not None:
+        def propose(tid):
+            target = _last_message(tid)
+            vetoes.propose(tid, lambda: twitterstream.next(target=target))
+        log_threads(cupidbot, threads, digests, pool=pool, on_synced=propose)
+        vetoes.join()
+    else:
+        log_threads(cupidbot, threads, digests, pool=pool)
+        for tid in threads:
+            target = _last_message(tid)
+
+            get_tweet = True
+
+            while get_tweet:
+                response = twitterstream.next(target=target)
+                try:
+                    print 'RESPONDING WITH: "%s"' % response
+                except UnicodeEncodeError:
+                    print 'Unicode error. Getting new tweet'
+                    continue
                 
-            sys.stdout.flush()
+                sys.stdout.flush()
+
+                rlist, _, _ = select([sys.stdin], [], [], PROMPT_TIMEOUT)
+                if len(rlist) == 0:
+                    get_tweet = False
+                else:
+                    # the user entered something, get a new tweet
+                    get_tweet = True
+
+            cupidbot.reply_to_thread(tid, response, dry_run=False)
+            #log_threads(cupidbot, [tid])
 
-            rlist, _, _ = select([sys.stdin], [], [], PROMPT_TIMEOUT)
-            if len(rlist) == 0:
-                get_tweet = False
-            else:
-                # the user entered something, get a new tweet
-                get_tweet = True
+    logging.info('ranking cache: %s', twitterstream.rankings.stats())
+    logging.info('page parsing: %s', cupidbot.parse_stats)
 
-        cupidbot.reply_to_thread(tid, response, dry_run=False)
-        #log_threads(cupidbot, [tid])
-        okcupid.sleep()
 
+def _last_message(tid):
+    from lib import models
+    from lib.database import db
+    return db.query(models.Message.body).join(models.Thread) \
+        .filter(models.Thread.okc_id == tid) \
+        .order_by(models.Message.id.desc()).limit(1).scalar()
 
-def log_threads(cupidbot, thread_ids=None):
-    """Open each thread and save it to the local database
+
+@metrics.timed('log_threads')
+def log_threads(cupidbot, thread_ids=None, digests=None, pool=None,
+                on_synced=None, session=None):
+    """Open each thread and save its new messages to the local database
+
+    Parameters
+    ----------
+    cupidbot : okcupid.OkCupid
+    thread_ids : list of str, optional
+        The threads to log. By default, every thread on the messages page
+    digests : dict, optional
+        Maps thread ids to the digest of their row on the messages page (see
+        `OkCupid.get_thread_summaries`). A thread whose digest hasn't changed
+        since it was last synced is skipped without being opened.
+    pool : scraper.ScrapePool, optional
+        Workers to scrape the threads with, concurrently. The database is
+        only ever touched from the calling thread.
+    on_synced : callable, optional
+        Called with each thread id once that thread is up to date in the
+        database, whether it was just logged or skipped as unchanged
+    session : sqlalchemy session, optional
+        The database to log to, by default `database.db`
+
+    Returns
+    -------
+    n_scraped : int
+        How many of the threads had changed, and were scraped
     """
+    from lib import models
+    from lib.database import db, ingest_thread
+
+    if session is None:
+        session = db
     if thread_ids is None:
-        thread_ids = cupidbot.get_threads()
+        summaries = cupidbot.get_thread_summaries()
+        thread_ids = [tid for tid, digest in summaries]
+        digests = dict(summaries)
+    if digests is None:
+        digests = {}
 
     logging.info('Logging thread ids: %s', thread_ids)
 
+    jobs = []
     for tid in thread_ids:
+        thread = session.query(models.Thread).filter_by(okc_id=tid).first()
+        digest = digests.get(tid)
+        if (thread is not None and thread.last_okc_id is not None and
+                digest is not None and thread.inbox_digest == digest):
+            logging.info('Thread %s unchanged since %s, skipping', tid,
+                         thread.synced)
+            if on_synced is not None:
+                on_synced(tid)
+            continue
+        jobs.append((tid, thread.last_okc_id if thread is not None else None))
+
+    if pool is not None:
+        scraped = pool.iscrape(jobs)
+    else:
+        scraped = ((tid, cupidbot.scrape_thread(tid, after=after))
+                   for tid, after in jobs)
+
+    for tid, messages in scraped:
         logging.info('Logging thread %s', tid)
-        thread = get_or_create(db, models.Thread, okc_id=tid)
-        db.add(thread)
-        db.flush()
+        thread, inserted, skipped = ingest_thread(
+            session, tid, messages, inbox_digest=digests.get(tid),
+            account=cupidbot.username)
+        logging.info('committed thread: %d new messages, %d already stored',
+                     inserted, skipped)
+        if on_synced is not None:
+            on_synced(tid)
+    return len(jobs)
+
+
+def run(cupidbot, twitterstream, vetoes=None, scrape_workers=1):
+    """Log in, then keep on polling the inbox and replying
 
-        msgs = cupidbot.scrape_thread(tid)
-        for msg in msgs:
-            params = {'okc_id': msg['id'], 'thread_id': thread.id,
-                      'sender': msg['sender'], 'body': msg['body'],
-                      'fancydate': msg['fancydate']}
-            message = get_or_create(db, models.Message, **params)
-            logging.info(params)
-            db.add(message)
+    Parameters
+    ----------
+    cupidbot : okcupid.OkCupid
+    twitterstream : twitter.Tweeterator
+    vetoes : veto.VetoQueue, optional
+        Where to propose the replies, see `respond_to_messages`. They're
+        sent from a browser of this account's own.
+    scrape_workers : int
+        Size of the account's `ScrapePool`
+    """
+    from lib.scheduler import PollScheduler
+    from lib.database import db
 
-        db.commit()
-        logging.info('committed thread')
+    if not cupidbot._logged_in:
+        cupidbot.login()
+    pool = ScrapePool.spawn(cupidbot, scrape_workers)
 
+    scheduler = PollScheduler(
+        initial=60 * SETTINGS.sleep_time_minutes,
+        floor=60 * getattr(SETTINGS, 'poll_floor_minutes', 1),
+        ceiling=60 * getattr(SETTINGS, 'poll_ceiling_minutes', 180))
 
-def main():
-    cupidbot, twitterstream = setup()
-    cupidbot.login()
+    if vetoes is not None:
+        # the replies go out from a browser of their own, while the
+        # pool keeps on scraping
+        vetoes = Sender(vetoes, cupidbot.spawn().reply_to_thread)
 
-    #log_threads(cupidbot)
+    #log_threads(cupidbot, pool=pool)
 
     while True:
-        respond_to_messages(cupidbot, twitterstream)
-        cupidbot._browser.get('http://www.google.com')
+        with metrics.span('cycle'):
+            respond_to_messages(cupidbot, twitterstream, pool, vetoes)
+        metrics.flush()
+
+        seconds = scheduler.next_interval(db, cupidbot.username)
+        logging.info('next poll in %.0f seconds for %s', seconds,
+                     cupidbot.username)
+        with metrics.span('sleep'):
+            okcupid.sleep(seconds)
 
-        # random number close to 60 (seconds)
-        r = 60 * (1 + 0.2*np.random.randn())
-        okcupid.sleep(SETTINGS.sleep_time_minutes * r)
+
+def supervise(accounts):
+    """Run several accounts at once, each on a thread of its own
+
+    They all share one rate limiter, one Tweeterator (so the timeline is
+    only pulled, sanitized and indexed once) and the console. The replies
+    always go through a `VetoQueue`, since the accounts can't take turns
+    at a blocking prompt.
+
+    With the `exclusive_tweets` setting (the default), no two accounts ever
+    get the same tweet. Without it, each account keeps track of the tweets
+    it has had in a store of its own, at `tweet_id_fn`.<username>, and only
+    avoids repeating itself.
+
+    Parameters
+    ----------
+    accounts : list of dict
+        Like the `okcupid` setting, which fills in anything left out
+    """
+    from lib.twitter import AccountTweeterator
+    from lib.seen import SeenIds
+
+    limiter = make_limiter()
+    shared = setup_tweets()
+    vetoes = VetoQueue(None, timeout=PROMPT_TIMEOUT)
+    exclusive = getattr(SETTINGS, 'exclusive_tweets', True)
+
+    workers = []
+    for account in accounts:
+        account = dict(SETTINGS.okcupid, **account)
+        cupidbot = make_bot(account, limiter)
+        if exclusive:
+            twitterstream = AccountTweeterator(shared)
+        else:
+            twitterstream = AccountTweeterator(shared, SeenIds(
+                '%s.%s' % (SETTINGS.tweet_id_fn, cupidbot.username)))
+
+        worker = threading.Thread(
+            target=run, name=cupidbot.username,
+            args=(cupidbot, twitterstream, vetoes),
+            kwargs={'scrape_workers': account.get('scrape_workers', 1)})
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+
+    # joining with a timeout, so that ctrl-c still gets through
+    while any(worker.is_alive() for worker in workers):
+        for worker in workers:
+            worker.join(1)
+
+
+def main():
+    """Run the account in the `okcupid` setting, or with an `accounts`
+    setting, all of those (see `supervise`)"""
+    startup()
+    metrics.configure(**getattr(SETTINGS, 'metrics', {'enabled': False}))
+    accounts = getattr(SETTINGS, 'accounts', None)
+    if accounts:
+        from lib.database import init_db
+        init_db()
+        return supervise(accounts)
+
+    cupidbot = make_bot(SETTINGS.okcupid, make_limiter())
+    # log in while SQLAlchemy and numpy are imported, the database is
+    # brought up to date, and the tweets are loaded and indexed. (Python 2
+    # holds a global lock while importing, and requests imports on every
+    # request, so only the first request overlaps the imports.) If the
+    # login fails, `run` tries again, and this time the error isn't lost on
+    # another thread
+    login = threading.Thread(target=cupidbot.login, name='login')
+    login.daemon = True
+    login.start()
+    from lib.database import init_db
+    init_db()
+    twitterstream = setup_tweets()
+    login.join()
+
+    vetoes = None
+    if getattr(SETTINGS, 'pipeline_replies', False):
+        vetoes = VetoQueue(None, timeout=PROMPT_TIMEOUT)
+    run(cupidbot, twitterstream, vetoes,
+        scrape_workers=SETTINGS.okcupid.get('scrape_workers', 1))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,554 @@
+#!/usr/bin/env python
+"""
+Offline benchmarks for the hot paths of the bot: ranking tweets, sanitizing
+them, parsing the message pages and ingesting threads into the database,
+plus how long the bot and the console take to start up.
+
+Nothing here needs an account. The tweets are synthetic, the inbox and
+thread pages are generated to look like the site's, and the database is a
+temporary SQLite file. Everything is seeded, so two runs on the same commit
+see the same inputs.
+
+Each benchmark runs at several scales (the number of tweets in the buffer,
+threads in the inbox, messages in a thread or in the database) and reports
+latency percentiles and throughput. The results can be written to a JSON
+file and compared against the results from another commit:
+
+    python bench.py -o before.json
+    python bench.py -o after.json -c before.json
+
+Where the startup time goes, import by import (like python 3's
+`-X importtime`):
+
+    python bench.py --imports app
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import tempfile
+import datetime
+import subprocess
+import numpy as np
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from lib import models
+from lib.schema import DATABASE_FILE, SCHEMA_VERSION
+from lib.okcupid import OkCupid, THREAD_URL
+from lib.twitter import SortedTweeterator, levenshtein, sanitize
+from lib.distance import encode, pad, batch_levenshtein
+from lib.corpus import JSONLSource
+from lib.ratelimit import TokenBucket
+from lib.database import Base, ingest_thread, tune_sqlite
+
+##############################################################################
+# Globals
+##############################################################################
+
+SCALES = [100, 1000, 10000, 100000]
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# run in a fresh interpreter by `profile_imports`: times every import
+# statement, and prints a JSON line per module that got loaded, with the
+# time spent in its own import and in total, in microseconds
+IMPORT_PROFILER = r"""
+import sys, json, time, __builtin__
+real_import = __builtin__.__import__
+# per import in progress: [time spent in nested imports, what they loaded]
+stack, found = [], []
+def timed_import(name, *args, **kwargs):
+    before = set(sys.modules)
+    stack.append([0.0, set()])
+    start = time.time()
+    try:
+        return real_import(name, *args, **kwargs)
+    finally:
+        elapsed = time.time() - start
+        nested, claimed = stack.pop()
+        loaded = set(sys.modules) - before
+        if stack:
+            stack[-1][0] += elapsed
+            stack[-1][1].update(loaded)
+        new = sorted(m for m in loaded - claimed if sys.modules[m] is not None)
+        if new:
+            found.append((', '.join(new), len(stack), elapsed - nested,
+                          elapsed))
+__builtin__.__import__ = timed_import
+import %s
+__builtin__.__import__ = real_import
+for name, depth, own, total in found:
+    print json.dumps({'module': name, 'depth': depth,
+                      'self_us': int(own * 1e6), 'total_us': int(total * 1e6)})
+"""
+
+# a p50 that gets this much slower than the baseline is a regression
+TOLERANCE = 0.2
+
+WORDS = ('the a i you it my so this that just like love what is not be me '
+         'when your all get one now day people time know going good think '
+         'really new more can never back coffee work today night tonight '
+         'weekend dog cat pizza music show watch read book again always '
+         'everyone someone nothing something why how who would could should '
+         'lol omg ok yes no maybe thanks sorry hey hello wow great best worst '
+         'city home train bus rain sun summer winter morning tomorrow').split()
+
+##############################################################################
+# Functions
+##############################################################################
+
+
+def make_tweets(n, rng):
+    """`n` random tweets, with the occasional link, hashtag, mention and
+    html entity for `sanitize` to deal with"""
+    # zipf-ish word frequencies, like real text
+    weights = 1.0 / np.arange(1, len(WORDS) + 1)
+    weights /= weights.sum()
+
+    tweets = []
+    for i in range(n):
+        words = list(rng.choice(WORDS, size=rng.randint(3, 25), p=weights))
+        extra = rng.randint(8)
+        if extra == 0:
+            words.append('http://t.co/%07x' % rng.randint(1 << 28))
+        elif extra == 1:
+            words.insert(0, '@user%d' % rng.randint(1000))
+        elif extra == 2:
+            words.append('#%s' % rng.choice(WORDS))
+        elif extra == 3:
+            words.insert(rng.randint(len(words)), '&amp;')
+        tweets.append({'id': 10 ** 17 + i, 'text': ' '.join(words)})
+    return tweets
+
+
+def inbox_page(n_threads, rng):
+    "A messages page listing `n_threads` threads"
+    rows = []
+    for i in range(n_threads):
+        cls = 'unreadMessage' if rng.randint(2) else 'readMessage'
+        rows.append(
+            '<li class="%s"><a class="photo" href="/profile/suitor%d"></a>'
+            '<p onclick="window.location=\'/messages?readmsg=true&amp;'
+            'threadid=%d&amp;folder=1\'">suitor%d: %s</p>'
+            '<span class="fancydate">Oct %d</span></li>'
+            % (cls, i, 1000000 + i, i, ' '.join(rng.choice(WORDS, 8)),
+               1 + i % 28))
+    return ('<html><head><title>Messages</title></head><body>'
+            '<ul id="messages">%s</ul></body></html>' % ''.join(rows))
+
+
+def thread_page(n_messages, rng, thread_id=0):
+    "A thread page with `n_messages` messages back and forth"
+    rows = []
+    for i in range(n_messages):
+        sender = 'okbot' if i % 2 else 'suitor%d' % thread_id
+        rows.append(
+            '<li id="message_%d_%d"><a class="photo" href="/profile/%s"></a>'
+            '<div class="message_body">%s</div>'
+            '<span class="fancydate">Oct %d, 2013</span></li>'
+            % (thread_id, i, sender, ' '.join(rng.choice(WORDS, 15)),
+               1 + i % 28))
+    return ('<html><head><title>Thread</title></head><body>'
+            '<ul id="thread">%s<li id="compose"></li></ul></body></html>'
+            % ''.join(rows))
+
+
+def thread_messages(n_messages, rng, thread_id=0):
+    "What `OkCupid.scrape_thread` would return for a `thread_page`"
+    return [{'id': '%d_%d' % (thread_id, i),
+             'sender': 'okbot' if i % 2 else 'suitor%d' % thread_id,
+             'body': ' '.join(rng.choice(WORDS, 15)),
+             'fancydate': 'Oct %d, 2013' % (1 + i % 28)}
+            for i in range(n_messages)]
+
+
+def repeats_for(n, budget=20000, lo=3, hi=200):
+    "How many times to repeat a call that handles `n` items"
+    return int(min(max(budget // max(n, 1), lo), hi))
+
+
+def measure(fn, repeats, setup=None):
+    """Time `repeats` calls to `fn`, calling `setup` (untimed) before each
+
+    Returns
+    -------
+    seconds : list of float
+    """
+    seconds = []
+    for i in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.time()
+        fn()
+        seconds.append(time.time() - start)
+    return seconds
+
+
+def summarize(name, scale, seconds, items_per_call=1):
+    """Latency percentiles and throughput of some timings
+
+    Parameters
+    ----------
+    name : str
+    scale : int
+    seconds : list of float
+        The latency of each call
+    items_per_call : int
+        How many items (tweets, messages, ...) each call handled
+    """
+    seconds = np.asarray(seconds)
+    p50, p90, p99 = np.percentile(seconds, [50, 90, 99])
+    return {'name': name, 'scale': scale, 'calls': len(seconds),
+            'items_per_call': items_per_call,
+            'mean': float(seconds.mean()), 'p50': float(p50),
+            'p90': float(p90), 'p99': float(p99),
+            'throughput': items_per_call / max(float(seconds.mean()), 1e-12)}
+
+
+def bench_levenshtein(n, rng, workdir):
+    """The exact distance between pairs of tweets, one pair at a time, in
+    pure python. Only the pool the pairs are drawn from grows with `n`"""
+    texts = [t['text'] for t in make_tweets(min(n, 1000), rng)]
+    pairs = iter([(texts[rng.randint(len(texts))],
+                   texts[rng.randint(len(texts))]) for i in range(200)])
+    seconds = measure(lambda: levenshtein(*next(pairs)), 200)
+    return [summarize('levenshtein', n, seconds)]
+
+
+def bench_batch_levenshtein(n, rng, workdir):
+    "The exact distance from one target to every one of `n` tweets"
+    codes, lengths = pad([encode(t['text']) for t in make_tweets(n, rng)])
+    targets = [t['text'] for t in make_tweets(50, rng)]
+    repeats = repeats_for(n)
+    seconds = measure(
+        lambda: batch_levenshtein(targets[rng.randint(len(targets))],
+                                  codes, lengths), repeats)
+    return [summarize('batch_levenshtein', n, seconds, items_per_call=n)]
+
+
+def bench_sanitize(n, rng, workdir):
+    "Sanitizing raw tweets, one at a time"
+    texts = iter([t['text'] for t in make_tweets(n, rng)])
+    seconds = measure(lambda: sanitize(next(texts)), n)
+    return [summarize('sanitize', n, seconds)]
+
+
+def ranking(scorer, name, n, rng, workdir):
+    """`SortedTweeterator.next` with `n` tweets in the buffer: building the
+    index, and then queries with new targets (cursor misses) and repeated
+    targets (cursor hits)"""
+    fixture = os.path.join(workdir, '%s-tweets-%d.jsonl' % (name, n))
+    with open(fixture, 'w') as f:
+        for tweet in make_tweets(n, rng):
+            f.write(json.dumps(tweet) + '\n')
+    source = JSONLSource(fixture)
+
+    tweeterator = SortedTweeterator(
+        tweet_id_fn=os.path.join(workdir, '%s-seen-%d' % (name, n)),
+        source=source, scorer=scorer)
+    # keep it from pulling more halfway through
+    tweeterator.ideal_buffer_len = 0
+    start = time.time()
+    tweeterator.warm_start(source, n)
+    build = time.time() - start
+
+    queries = min(repeats_for(n, budget=100000), n // 4)
+    targets = [' '.join(rng.choice(WORDS, rng.randint(3, 20)))
+               for i in range(queries)]
+    misses = iter(targets)
+    seconds = measure(lambda: tweeterator.next(target=next(misses)), queries)
+
+    # the first call for a target fills its cursor, the rest use it
+    target = targets[0]
+    tweeterator.next(target=target)
+    hits = measure(lambda: tweeterator.next(target=target),
+                   min(tweeterator.cursor_len - 1, len(tweeterator.buffer)))
+    tweeterator.seen_ids.close()
+
+    return [summarize(name + '.build', n, [build], items_per_call=n),
+            summarize(name + '.next', n, seconds),
+            summarize(name + '.next_cached', n, hits)]
+
+
+def bench_ranking(n, rng, workdir):
+    "Ranking by normalized Levenshtein distance, see `ranking`"
+    return ranking('levenshtein', 'ranking', n, rng, workdir)
+
+
+def bench_ranking_tfidf(n, rng, workdir):
+    "Ranking by TF-IDF cosine similarity, see `ranking`"
+    return ranking('tfidf', 'ranking_tfidf', n, rng, workdir)
+
+
+def bench_pages(n, rng, workdir):
+    """Parsing the inbox with `n` threads and a thread with `n` messages,
+    the way `OkCupid.get_thread_summaries` and `OkCupid.scrape_thread` do"""
+    pages = {'/messages': inbox_page(n, rng),
+             THREAD_URL % 0: thread_page(n, rng)}
+    bot = OkCupid('okbot', None, browser=FixtureTransport(pages),
+                  base_url='%s', limiter=TokenBucket(rate=1e9, jitter=0))
+    bot._logged_in = True
+
+    def forget():
+        # make every call parse the page again
+        bot._dom_key = None
+
+    repeats = repeats_for(n, budget=10000, hi=50)
+    inbox = measure(lambda: bot.get_thread_summaries(
+                        ['unreadMessage', 'readMessage']), repeats, forget)
+    thread = measure(lambda: bot.scrape_thread(0), repeats, forget)
+    tail = measure(lambda: bot.scrape_thread(0, after='0_%d' % (n - 2)),
+                   repeats, forget)
+    cached = measure(lambda: bot.scrape_thread(0, after='0_%d' % (n - 2)),
+                     repeats)
+
+    return [summarize('pages.inbox', n, inbox, items_per_call=n),
+            summarize('pages.thread', n, thread, items_per_call=n),
+            summarize('pages.thread_tail', n, tail),
+            summarize('pages.thread_tail_cached', n, cached)]
+
+
+def bench_ingest(n, rng, workdir, thread_len=50):
+    """Ingesting `n` messages into a fresh database, `thread_len` per
+    thread, and then syncing the same threads again with one new message
+    each"""
+    engine = create_engine('sqlite:///%s' %
+                           os.path.join(workdir, 'bench-%d.sqlite' % n))
+    tune_sqlite(engine)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+    n_threads = max(n // thread_len, 1)
+    threads = [thread_messages(thread_len, rng, thread_id=i)
+               for i in range(n_threads)]
+
+    def ingest_all():
+        ids = iter(range(n_threads))
+        def ingest_next():
+            i = next(ids)
+            ingest_thread(session, str(i), threads[i])
+        return measure(ingest_next, n_threads)
+
+    first = ingest_all()
+    for i, messages in enumerate(threads):
+        messages.extend(thread_messages(thread_len + 1, rng, thread_id=i)[-1:])
+    again = ingest_all()
+    session.close()
+
+    return [summarize('ingest.new_thread', n, first, items_per_call=thread_len),
+            summarize('ingest.resync', n, again, items_per_call=thread_len + 1)]
+
+
+def bench_startup(workdir, repeats=10):
+    """Wall time from launching python until the bot or the console has
+    loaded, each time in a fresh interpreter. These don't depend on a scale,
+    so they're only run once, at scale 1."""
+    # the console's database, created and migrated ahead of time
+    engine = create_engine('sqlite:///%s' % os.path.join(workdir,
+                                                         DATABASE_FILE))
+    models.Base.metadata.create_all(bind=engine)
+    engine.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+    engine.dispose()
+
+    commands = [
+        ('startup.python', ['-c', 'pass'], ROOT),
+        ('startup.import_app', ['-c', 'import app'], ROOT),
+        ('startup.console_help',
+         [os.path.join(ROOT, 'console.py'), 'threads', '--help'], workdir),
+        ('startup.console_json',
+         [os.path.join(ROOT, 'console.py'), 'threads', '-f', 'json'],
+         workdir),
+    ]
+    with open(os.devnull, 'w') as devnull:
+        for name, args, cwd in commands:
+            def launch():
+                subprocess.check_call([sys.executable] + args, cwd=cwd,
+                                      stdout=devnull, stderr=devnull)
+            # once untimed, so that the .pyc files are written
+            launch()
+            yield summarize(name, 1, measure(launch, repeats))
+
+
+def profile_imports(module, top=25):
+    """Import a module in a fresh interpreter and print the slowest imports
+
+    Returns
+    -------
+    imports : list of dict
+        The 'module', its nesting 'depth' and its 'self_us' and 'total_us'
+        import times, in the order they finished
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_PROFILER % module], cwd=ROOT)
+    imports = [json.loads(line) for line in output.splitlines()
+               if line.startswith('{')]
+    print '%10s %10s  module' % ('self ms', 'total ms')
+    for entry in sorted(imports, key=lambda e: -e['total_us'])[:top]:
+        print '%10.1f %10.1f  %s%s' % (entry['self_us'] / 1e3,
+                                      entry['total_us'] / 1e3,
+                                      '  ' * entry['depth'], entry['module'])
+    return imports
+
+
+BENCHMARKS = [bench_levenshtein, bench_batch_levenshtein, bench_sanitize,
+              bench_ranking, bench_ranking_tfidf, bench_pages, bench_ingest]
+
+
+def run(scales, only=None, seed=0):
+    """Run the benchmarks at each scale
+
+    Parameters
+    ----------
+    scales : list of int
+    only : list of str, optional
+        Names of the benchmarks to run (e.g. 'ranking'), by default all
+    seed : int
+
+    Returns
+    -------
+    results : list of dict
+        One per benchmark, scale and measured operation, see `summarize`
+    """
+    results = []
+    workdir = tempfile.mkdtemp(prefix='okbot-bench-')
+    try:
+        for bench in BENCHMARKS:
+            name = bench.__name__.replace('bench_', '')
+            if only is not None and name not in only:
+                continue
+            for n in scales:
+                rng = np.random.RandomState(seed)
+                random.seed(seed)
+                for result in bench(n, rng, workdir):
+                    print >>sys.stderr, format_result(result)
+                    results.append(result)
+        if only is None or 'startup' in only:
+            for result in bench_startup(workdir):
+                print >>sys.stderr, format_result(result)
+                results.append(result)
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+
+def environment():
+    "What the results were measured on"
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(),
+            'machine': platform.platform(), 'numpy': np.__version__,
+            'date': datetime.datetime.utcnow().isoformat()}
+
+
+def format_result(result):
+    return ('%-26s %7d  p50 %9.3fms  p90 %9.3fms  p99 %9.3fms  %12.1f/s' %
+            (result['name'], result['scale'], 1e3 * result['p50'],
+             1e3 * result['p90'], 1e3 * result['p99'], result['throughput']))
+
+
+def compare(baseline, results, tolerance=TOLERANCE):
+    """Print how the p50 latencies changed since the baseline
+
+    Returns
+    -------
+    regressions : list of dict
+        The results that got more than `tolerance` slower
+    """
+    before = dict(((r['name'], r['scale']), r) for r in baseline['results'])
+    regressions = []
+    for result in results:
+        old = before.get((result['name'], result['scale']))
+        if old is None:
+            continue
+        ratio = result['p50'] / max(old['p50'], 1e-12)
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  REGRESSION'
+            regressions.append(result)
+        print '%-26s %7d  p50 %9.3fms -> %9.3fms  x%.2f%s' % (
+            result['name'], result['scale'], 1e3 * old['p50'],
+            1e3 * result['p50'], ratio, flag)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-s', '--scales', default=','.join(map(str, SCALES)),
+                        help='comma separated sizes to run at')
+    parser.add_argument('-b', '--bench', action='append',
+                        help='only run this benchmark (can be repeated): %s' %
+                        ', '.join([b.__name__.replace('bench_', '')
+                                   for b in BENCHMARKS] + ['startup']))
+    parser.add_argument('-o', '--output', help='write the results to this '
+                        'JSON file')
+    parser.add_argument('-c', '--compare', help='compare against the results '
+                        'in this JSON file, exiting with status 1 on a '
+                        'regression')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--imports', metavar='MODULE', help='just show where '
+                        'the time goes when importing this module')
+    args = parser.parse_args()
+
+    if args.imports is not None:
+        profile_imports(args.imports)
+        return
+
+    scales = [int(s) for s in args.scales.split(',')]
+    results = run(scales, only=args.bench, seed=args.seed)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f,
+                      indent=2, sort_keys=True)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if len(compare(baseline, results, args.tolerance)) > 0:
+            sys.exit(1)
+
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class FixtureTransport(object):
+    "Stands in for a transport, serving pages from a dict of url -> html"
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.current_url = None
+
+    @property
+    def page_source(self):
+        return self.pages[self.current_url]
+
+    @property
+    def title(self):
+        return u''
+
+    def get(self, url):
+        self.current_url = url
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    main()
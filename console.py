@@ -1,20 +1,215 @@
 import sys
-from lib.models import *
-from lib.database import db
-from lib.settings import Settings
-SETTINGS = Settings('settings.yml')
+import csv
+import json
+import sqlite3
+import argparse
+import datetime
 
+from lib.schema import DATABASE_FILE, SCHEMA_VERSION
+
+# This only reads the database, so it talks to sqlite directly and only
+# brings in SQLAlchemy (for lib.database) when the schema needs migrating,
+# and the settings (and yaml) when the text output needs the username. Both
+# take several times longer to import than everything else here.
 
 methods = ['threads']
 
-def threads():
-    for thread in db.query(Thread).all():
-        for msg in thread.messages:
-            if msg.sender == SETTINGS.okcupid['username']:
-                print '[OkBot]:  %s' % msg.body.encode('utf-8').strip()
-            else:
-                print '[Suitor]: %s' % msg.body.encode('utf-8').strip()
-        print
+# rows fetched from the database at a time
+WINDOW = 1000
+
+# how SQLAlchemy stores DateTime columns in sqlite
+sqlite3.register_converter('DATETIME', sqlite3.converters['TIMESTAMP'])
+
+FIELDS = ['thread', 'id', 'okc_id', 'sender', 'body', 'fancydate', 'timestamp',
+          'logged']
+# the columns of the messages table (see lib/models.py) behind FIELDS[1:]
+COLUMNS = FIELDS[1:]
+
+
+def parse_date(text):
+    return datetime.datetime.strptime(text, '%Y-%m-%d')
+
+
+def connect():
+    """Open the database, first creating or migrating it (see
+    `lib.database.init_db`) if it's missing any of the columns this reads,
+    or any of the data migrations"""
+    conn = sqlite3.connect(DATABASE_FILE, detect_types=sqlite3.PARSE_DECLTYPES)
+    try:
+        conn.execute('SELECT %s FROM messages LIMIT 0' % ', '.join(COLUMNS))
+        current = conn.execute('PRAGMA user_version').fetchone()[0] >= \
+            SCHEMA_VERSION
+    except sqlite3.OperationalError:
+        current = False
+    if not current:
+        conn.close()
+        from lib.database import init_db
+        init_db()
+        conn = sqlite3.connect(DATABASE_FILE,
+                               detect_types=sqlite3.PARSE_DECLTYPES)
+    return conn
+
+
+def load_settings():
+    from lib.settings import Settings
+    return Settings('settings.yml')
+
+
+def messages(thread_ids=None, senders=None, since=None, until=None,
+             after=None, limit=None, conn=None):
+    """Stream messages, thread by thread, oldest first, in a single windowed
+    query. Only `WINDOW` rows are held in memory at a time.
+
+    Parameters
+    ----------
+    thread_ids : list of str, optional
+        Only these threads (okcupid thread ids)
+    senders : list of str, optional
+        Only messages from these senders
+    since, until : datetime.datetime, optional
+        Only messages sent in [since, until)
+    after : (int, int), optional
+        Pagination cursor: the (thread, message) database ids of the last
+        message of the previous page
+    limit : int, optional
+        Page size
+    conn : sqlite3.Connection, optional
+        Defaults to a new one from `connect`
+
+    Yields
+    ------
+    message : dict
+        With the `FIELDS`. 'thread' is the okcupid thread id, 'id' the
+        message's database id
+    """
+    if conn is None:
+        conn = connect()
+
+    where, params = [], []
+    if thread_ids:
+        where.append('threads.okc_id IN (%s)' % ', '.join('?' * len(thread_ids)))
+        params.extend(thread_ids)
+    if senders:
+        where.append('messages.sender IN (%s)' % ', '.join('?' * len(senders)))
+        params.extend(senders)
+    if since is not None:
+        where.append('messages.timestamp >= ?')
+        params.append(format_datetime(since))
+    if until is not None:
+        where.append('messages.timestamp < ?')
+        params.append(format_datetime(until))
+    if after is not None:
+        where.append('(messages.thread_id > ? OR '
+                     '(messages.thread_id = ? AND messages.id > ?))')
+        params.extend([after[0], after[0], after[1]])
+
+    sql = ('SELECT messages.thread_id, threads.okc_id, %s FROM messages '
+           'JOIN threads ON messages.thread_id = threads.id' %
+           ', '.join('messages.%s' % c for c in COLUMNS))
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY messages.thread_id, messages.id'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(WINDOW)
+        if not rows:
+            break
+        for row in rows:
+            yield dict(zip(['thread_pk'] + FIELDS, row))
+
+
+def format_datetime(value):
+    "The way SQLAlchemy stores a DateTime in sqlite, so that they compare"
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def write_text(rows, out):
+    username = load_settings().okcupid['username']
+    thread = None
+    for row in rows:
+        if thread is not None and row['thread'] != thread:
+            print >> out
+        thread = row['thread']
+        if row['sender'] == username:
+            print >> out, '[OkBot]:  %s' % row['body'].encode('utf-8').strip()
+        else:
+            print >> out, '[Suitor]: %s' % row['body'].encode('utf-8').strip()
+    if thread is not None:
+        print >> out
+
+
+def write_json(rows, out):
+    "One JSON object per line, so the output streams too"
+    for row in rows:
+        print >> out, json.dumps(dict((k, row[k]) for k in FIELDS),
+                                 default=lambda d: d.isoformat())
+
+
+def write_csv(rows, out):
+    writer = csv.writer(out)
+    writer.writerow(FIELDS)
+    for row in rows:
+        writer.writerow([encode_field(row[k]) for k in FIELDS])
+
+
+def encode_field(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+WRITERS = {'text': write_text, 'json': write_json, 'csv': write_csv}
+
+
+def threads(argv=()):
+    parser = argparse.ArgumentParser(
+        prog='%s threads' % sys.argv[0],
+        description='Export the logged conversations')
+    parser.add_argument('-t', '--thread', action='append',
+                        help='only this thread id (can be repeated)')
+    parser.add_argument('-s', '--sender', action='append',
+                        help='only messages from this sender (can be repeated)')
+    parser.add_argument('--since', type=parse_date,
+                        help='only messages sent on or after YYYY-MM-DD')
+    parser.add_argument('--until', type=parse_date,
+                        help='only messages sent before YYYY-MM-DD')
+    parser.add_argument('-n', '--limit', type=int,
+                        help='page size, in messages')
+    parser.add_argument('--after', help='cursor printed at the end of the '
+                        'previous page')
+    parser.add_argument('-f', '--format', choices=sorted(WRITERS),
+                        default='text')
+    args = parser.parse_args(argv)
+
+    after = None
+    if args.after is not None:
+        after = tuple(int(i) for i in args.after.split(':'))
+
+    # the last row written, and how many there were
+    last = [None, 0]
+
+    def remember_last(rows):
+        for row in rows:
+            last[:] = [row, last[1] + 1]
+            yield row
+
+    rows = messages(thread_ids=args.thread, senders=args.sender,
+                    since=args.since, until=args.until, after=after,
+                    limit=args.limit)
+    WRITERS[args.format](remember_last(rows), sys.stdout)
+
+    row, n = last
+    if args.limit is not None and n == args.limit:
+        print >> sys.stderr, 'next page: --after %d:%d' % (row['thread_pk'],
+                                                           row['id'])
 
 
 def print_usage():
@@ -24,9 +219,8 @@ def print_usage():
 if __name__ == '__main__':
     try:
         if sys.argv[1] in methods:
-            globals()[sys.argv[1]]()
+            globals()[sys.argv[1]](sys.argv[2:])
         else:
             print_usage()
     except IndexError:
         print_usage()
-                
\ No newline at end of file
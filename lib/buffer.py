@@ -0,0 +1,179 @@
+"""
+Column-wise store for the tweets a `twitter.Tweeterator` has buffered.
+
+Instead of a list of dicts, the ids live in an int64 array and the texts
+are packed back to back, UTF-8 encoded, into one byte array with an array
+of offsets into it. A tweet is about its length in bytes plus a couple of
+array entries, which makes buffers of 100k+ tweets cheap to keep around.
+
+Removal is O(1): the slot is tombstoned, and the arrays are compacted once
+most of them are dead.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import numpy as np
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['TweetBuffer']
+
+##############################################################################
+# Functions
+##############################################################################
+
+
+def _grow(array, size):
+    "`array`, with room for at least `size` entries"
+    if size <= len(array):
+        return array
+    new = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    new[:len(array)] = array
+    return new
+
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class TweetBuffer(object):
+    """Insertion-ordered set of (id, text) tweets
+
+    Not thread-safe by itself; `Tweeterator` guards it with its lock.
+    """
+
+    def __init__(self):
+        self._slots = {}           # id -> slot
+        self._ids = np.zeros(16, dtype=np.int64)
+        self._alive = np.zeros(16, dtype=bool)
+        # the text of slot i is _data[_offsets[i]:_offsets[i + 1]]
+        self._offsets = np.zeros(17, dtype=np.int64)
+        self._data = np.zeros(1024, dtype=np.uint8)
+        self._n_slots = 0
+        # no slot before this one is alive
+        self._head = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, tweet_id):
+        return tweet_id in self._slots
+
+    def __iter__(self):
+        "The (id, text) of every tweet, oldest first"
+        for slot in range(self._head, self._n_slots):
+            if self._alive[slot]:
+                yield int(self._ids[slot]), self._text(slot)
+
+    def append(self, tweet_id, text):
+        """Add a tweet at the end. Adding an id that is already present
+        does nothing.
+
+        Parameters
+        ----------
+        tweet_id : int
+        text : unicode
+            Or a str, taken to be UTF-8 already
+        """
+        if tweet_id in self._slots:
+            return
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        encoded = np.frombuffer(text, dtype=np.uint8)
+
+        slot = self._n_slots
+        self._ids = _grow(self._ids, slot + 1)
+        self._alive = _grow(self._alive, slot + 1)
+        self._offsets = _grow(self._offsets, slot + 2)
+        start = self._offsets[slot]
+        end = start + len(encoded)
+        self._data = _grow(self._data, end)
+
+        self._data[start:end] = encoded
+        self._offsets[slot + 1] = end
+        self._ids[slot] = tweet_id
+        self._alive[slot] = True
+        self._slots[tweet_id] = slot
+        self._n_slots += 1
+
+    def text(self, tweet_id):
+        "The text of a buffered tweet. Raises KeyError if it isn't here."
+        return self._text(self._slots[tweet_id])
+
+    def oldest(self):
+        "The id of the tweet that has been here longest"
+        if len(self._slots) == 0:
+            raise IndexError('The buffer is empty')
+        while not self._alive[self._head]:
+            self._head += 1
+        return int(self._ids[self._head])
+
+    def pop(self, tweet_id=None):
+        """Remove a tweet
+
+        Parameters
+        ----------
+        tweet_id : int, optional
+            Defaults to the oldest one
+
+        Returns
+        -------
+        tweet_id : int
+        text : unicode
+        """
+        if tweet_id is None:
+            tweet_id = self.oldest()
+        slot = self._slots.pop(tweet_id)
+        text = self._text(slot)
+        self._alive[slot] = False
+
+        n_dead = self._n_slots - len(self._slots)
+        if n_dead > 1024 and n_dead > len(self._slots):
+            self._compact()
+        return tweet_id, text
+
+    def ids(self):
+        """The ids of the buffered tweets, oldest first, as an int64 array
+
+        This is a copy with the tombstoned slots left out, not a view, so
+        the buffer can be changed while going through it.
+        """
+        n = self._n_slots
+        return self._ids[self._head:n][self._alive[self._head:n]]
+
+    def nbytes(self):
+        "Memory used by the arrays (not counting the id -> slot dict)"
+        return sum(a.nbytes for a in (self._ids, self._alive, self._offsets,
+                                      self._data))
+
+    def _text(self, slot):
+        start, end = self._offsets[slot], self._offsets[slot + 1]
+        return self._data[start:end].tostring().decode('utf-8')
+
+    def _compact(self):
+        "Rewrite the arrays without the tombstoned slots"
+        n = self._n_slots
+        live = np.flatnonzero(self._alive[:n])
+        starts, ends = self._offsets[live], self._offsets[live + 1]
+        lengths = ends - starts
+
+        offsets = np.zeros(len(live) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # gather every live byte in one go: each live text's bytes, shifted
+        # from its old start to its new one
+        shift = np.repeat(starts - offsets[:-1], lengths)
+        data = self._data[np.arange(offsets[-1]) + shift]
+
+        self._ids = self._ids[live].copy()
+        self._alive = np.ones(len(live), dtype=bool)
+        self._offsets = offsets
+        self._data = data
+        self._n_slots = len(live)
+        self._head = 0
+        self._slots = dict((tweet_id, slot) for slot, tweet_id
+                           in enumerate(self._ids.tolist()))
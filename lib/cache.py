@@ -0,0 +1,128 @@
+"""
+Small in-process caches.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import time
+from collections import OrderedDict
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['LRUCache']
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class LRUCache(object):
+    """Dict-like cache holding at most `maxsize` entries, evicting the least
+    recently used one when it fills up. With a `ttl`, entries also expire
+    that many seconds after they were put in.
+
+    Lookups through `get` are counted in `hits` and `misses` (of which
+    `expired` were there but too old), so the cache can be sized from how it
+    behaves in production.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        """Create an empty cache
+
+        Parameters
+        ----------
+        maxsize : int
+            Maximum number of entries
+        ttl : float, optional
+            Lifetime of an entry, in seconds. By default they live until
+            they're evicted.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        # key -> (value, expiry time or None)
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None, valid=None):
+        """Look up an entry, marking it as recently used
+
+        Parameters
+        ----------
+        key : hashable
+        default : object, optional
+            Returned on a miss
+        valid : callable, optional
+            If given, it's called with the cached value, and a value for
+            which it returns False is dropped and counted as a miss.
+
+        Returns
+        -------
+        value : object
+        """
+        try:
+            value, expires = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if expires is not None and expires <= time.time():
+            self.misses += 1
+            self.expired += 1
+            return default
+
+        if valid is not None and not valid(value):
+            self.misses += 1
+            return default
+
+        self._data[key] = value, expires
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        "Insert or replace an entry, evicting the oldest one if needed"
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+        self._data.pop(key, None)
+        self._data[key] = value, expires
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def items(self):
+        """The (key, value) of every entry that hasn't expired, least
+        recently used first. This doesn't count as using them."""
+        now = time.time()
+        return [(key, value) for key, (value, expires) in self._data.items()
+                if expires is None or expires > now]
+
+    def discard(self, key):
+        "Remove an entry, if it's present"
+        self._data.pop(key, None)
+
+    def clear(self):
+        "Remove all of the entries. The counters are left alone."
+        self._data.clear()
+
+    def stats(self):
+        """Summary of the cache's behavior
+
+        Returns
+        -------
+        stats : dict
+            'hits', 'misses', 'expired', 'size' and 'maxsize'
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'expired': self.expired, 'size': len(self._data),
+                'maxsize': self.maxsize}
@@ -0,0 +1,116 @@
+"""
+Local sources of tweets, for warm starts and for running without the
+twitter API.
+
+Every tweet source has a `fetch(count, max_id=None, since_id=None)` method
+with the same paging semantics as the home timeline API: it returns up to
+`count` tweets, newest first, with id <= max_id and id > since_id. Each
+tweet is a dict with the 'id' and the raw 'text', and optionally the
+already-'sanitized' text.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import json
+import bisect
+import datetime
+import logging
+
+from models import Tweet
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['TweetCorpus', 'JSONLSource']
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class TweetCorpus(object):
+    """Every tweet that's been pulled from the API, in the `tweets` table (or
+    another table with the same columns, like `tumblr_posts`).
+
+    This is both a place to record tweets and a source to serve them back
+    from.
+    """
+
+    def __init__(self, session, model=Tweet):
+        """
+        Parameters
+        ----------
+        session : sqlalchemy session
+            E.g. `database.db`. A scoped session is safe to share with the
+            prefetching threads.
+        model : class
+            `models.Tweet`, or `models.TumblrPost` for tumblr posts
+        """
+        self.session = session
+        self.model = model
+
+    def __len__(self):
+        return self.session.query(self.model).count()
+
+    def add(self, tweets):
+        """Record some tweets. Ones that are already in the corpus are
+        ignored.
+
+        Parameters
+        ----------
+        tweets : list of dict
+            Each with the 'id', the raw 'text' and the 'sanitized' text
+        """
+        if len(tweets) == 0:
+            return
+        pulled = datetime.datetime.utcnow()
+        rows = [{'id': t['id'], 'raw_text': t['text'],
+                 'text': t['sanitized'], 'pulled': pulled} for t in tweets]
+        insert = self.model.__table__.insert().prefix_with('OR IGNORE')
+        self.session.execute(insert, rows)
+        self.session.commit()
+
+    def fetch(self, count, max_id=None, since_id=None):
+        model = self.model
+        query = self.session.query(model.id, model.raw_text, model.text)
+        if max_id is not None:
+            query = query.filter(model.id <= max_id)
+        if since_id is not None:
+            query = query.filter(model.id > since_id)
+        rows = query.order_by(model.id.desc()).limit(count).all()
+        return [{'id': id, 'text': raw_text, 'sanitized': text}
+                for id, raw_text, text in rows]
+
+
+class JSONLSource(object):
+    """Tweets from a fixture file, with one JSON object per line. Each needs
+    at least an 'id' and a 'text', so raw API responses work as they are.
+    """
+
+    def __init__(self, filename):
+        tweets = {}
+        with open(filename) as f:
+            for line in f:
+                if line.strip():
+                    tweet = json.loads(line)
+                    tweets[tweet['id']] = tweet['text']
+
+        self._ids = sorted(tweets)
+        self._texts = [tweets[i] for i in self._ids]
+        logging.info('loaded %d tweets from %s', len(self._ids), filename)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def fetch(self, count, max_id=None, since_id=None):
+        hi = len(self._ids)
+        if max_id is not None:
+            hi = bisect.bisect_right(self._ids, max_id)
+        lo = max(hi - count, 0)
+        if since_id is not None:
+            lo = max(lo, bisect.bisect_right(self._ids, since_id))
+        return [{'id': self._ids[i], 'text': self._texts[i]}
+                for i in range(hi - 1, lo - 1, -1)]
@@ -1,17 +1,139 @@
-from sqlalchemy import create_engine
+import logging
+import datetime
+import metrics
+from dates import fancydate_to_utc
+from schema import DATABASE_FILE, SCHEMA_VERSION
+from sqlalchemy import create_engine, event, bindparam
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-engine = create_engine('sqlite:///database.sqlite', convert_unicode=True)
+engine = create_engine('sqlite:///%s' % DATABASE_FILE, convert_unicode=True)
 db = scoped_session(sessionmaker(autocommit=False,
                                          autoflush=False,
                                          bind=engine))
 Base = declarative_base()
 Base.query = db.query_property()
 
+
+def tune_sqlite(engine):
+    """Set the pragmas on every new connection: write-ahead logging, so
+    readers and the writer don't block each other, with fsyncs only at
+    checkpoints; a bigger page cache; and waiting on a lock instead of
+    failing straight away"""
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA cache_size=-16000')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.close()
+
+tune_sqlite(engine)
+
+
 def init_db():
     # create all!
     import models
     Base.metadata.create_all(bind=engine)
+    migrate()
+
+
+def migrate():
+    """Upgrade an existing database in place: add the columns and indexes
+    that create_all leaves out, then run the data migrations it hasn't
+    had yet (tracked in sqlite's user_version)"""
+    add_missing_columns()
+    add_missing_indexes()
+
+    version = engine.execute('PRAGMA user_version').scalar()
+    if version < 2:
+        # 1 parsed the fancydates, 2 falls back to when the messages were
+        # logged for the ones it couldn't
+        backfill_timestamps()
+    if version < SCHEMA_VERSION:
+        engine.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+
+
+def add_missing_columns():
+    """create_all leaves existing tables alone, so add any columns that have
+    been added to the models since the database was created"""
+    for table in Base.metadata.sorted_tables:
+        existing = set(row[1] for row in
+                       pragma_rows('table_info(%s)' % table.name))
+        for column in table.columns:
+            if column.name not in existing:
+                type_ = column.type.compile(dialect=engine.dialect)
+                engine.execute('ALTER TABLE %s ADD COLUMN %s %s' %
+                               (table.name, column.name, type_))
+
+
+def pragma_rows(pragma):
+    # a pragma with nothing to report has no result set at all
+    result = engine.execute('PRAGMA %s' % pragma)
+    if not result.returns_rows:
+        return []
+    return result.fetchall()
+
+
+def add_missing_indexes():
+    "Same as `add_missing_columns`, but for the indexes"
+    for table in Base.metadata.sorted_tables:
+        existing = set(row[1] for row in
+                       pragma_rows('index_list(%s)' % table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+
+
+def backfill_timestamps(chunk_size=1000):
+    """Parse the timestamps of the messages stored before there was a
+    timestamp column. The relative fancydates are resolved against when
+    the message was logged, or failing that when its thread was synced.
+
+    Messages whose fancydate can't be parsed get that time itself, which
+    the message can't have arrived after, rather than being left out of
+    `scheduler.PollScheduler.arrival_rate`. Only the ones with neither
+    stay without a timestamp.
+    """
+    import models
+    messages = models.Message.__table__
+    threads = models.Thread.__table__
+    query = (messages.select()
+             .with_only_columns([messages.c.id, messages.c.fancydate,
+                                 messages.c.logged, threads.c.synced])
+             .select_from(messages.outerjoin(
+                 threads, messages.c.thread_id == threads.c.id))
+             .where(messages.c.timestamp == None)
+             .order_by(messages.c.id).limit(chunk_size))
+    update = messages.update().where(
+        messages.c.id == bindparam('message_id')).values(
+        timestamp=bindparam('parsed'))
+
+    last_id = 0
+    n_fallbacks = n_missing = 0
+    while True:
+        rows = engine.execute(query.where(messages.c.id > last_id)).fetchall()
+        if len(rows) == 0:
+            break
+        params = []
+        for id, fancydate, logged, synced in rows:
+            parsed = fancydate_to_utc(fancydate, logged or synced)
+            if parsed is None:
+                parsed = logged or synced
+                if parsed is None:
+                    n_missing += 1
+                    continue
+                n_fallbacks += 1
+            params.append({'message_id': id, 'parsed': parsed})
+        if len(params) > 0:
+            engine.execute(update, params)
+        last_id = rows[-1][0]
+
+    if n_fallbacks > 0 or n_missing > 0:
+        logging.warning('Backfilling timestamps: %d unparseable fancydates '
+                        'set to when they were logged or synced, %d left '
+                        'without a timestamp', n_fallbacks, n_missing)
 
 def get_or_create(session, model, defaults=None, **kwargs):
     instance = session.query(model).filter_by(**kwargs).first()
@@ -22,3 +144,77 @@ def get_or_create(session, model, defaults=None, **kwargs):
         session.add(instance)
         return instance
 
+
+@metrics.timed('ingest_thread')
+def ingest_thread(session, okc_id, messages, inbox_digest=None,
+                  chunk_size=500, account=None):
+    """Save a whole scraped thread, inserting only the messages that aren't
+    already in the database, and update the thread's sync state.
+
+    The existing messages are found with one IN query per `chunk_size`
+    messages (sqlite caps the number of bound parameters), and the new
+    ones go in with a single INSERT OR IGNORE executemany.
+
+    Parameters
+    ----------
+    session : sqlalchemy session
+    okc_id : str
+        The thread's id on okcupid
+    messages : list of dict
+        As returned by `okcupid.OkCupid.scrape_thread`, oldest first
+    inbox_digest : str, optional
+        Digest of the thread's row on the messages page, see
+        `okcupid.OkCupid.get_thread_summaries`
+    chunk_size : int
+        Max number of ids per IN query
+    account : str, optional
+        Username of the account whose inbox the thread is in
+
+    Returns
+    -------
+    thread : models.Thread
+    inserted : int
+        Number of new messages
+    skipped : int
+        Number of messages that were already stored
+    """
+    import models
+    thread = get_or_create(session, models.Thread, okc_id=okc_id)
+    session.flush()
+
+    ids = [msg['id'] for msg in messages]
+    existing = set()
+    for i in range(0, len(ids), chunk_size):
+        query = session.query(models.Message.okc_id).filter(
+            models.Message.okc_id.in_(ids[i:i + chunk_size]))
+        existing.update(okc_id for (okc_id,) in query)
+
+    now = datetime.datetime.utcnow()
+    rows = []
+    for msg in messages:
+        if msg['id'] in existing:
+            continue
+        existing.add(msg['id'])
+        rows.append({'okc_id': msg['id'], 'thread_id': thread.id,
+                     'sender': msg['sender'], 'body': msg['body'],
+                     'fancydate': msg['fancydate'], 'logged': now,
+                     'timestamp': fancydate_to_utc(msg['fancydate'], now)})
+
+    inserted = 0
+    if len(rows) > 0:
+        result = session.execute(
+            models.Message.__table__.insert().prefix_with('OR IGNORE'), rows)
+        inserted = result.rowcount
+
+    if len(messages) > 0:
+        thread.last_okc_id = messages[-1]['id']
+    if inbox_digest is not None:
+        thread.inbox_digest = inbox_digest
+    if account is not None:
+        thread.account = account
+    thread.synced = now
+    with metrics.span('commit'):
+        session.commit()
+    metrics.count('messages_ingested', inserted)
+
+    return thread, inserted, len(messages) - inserted
@@ -0,0 +1,166 @@
+"""
+Turning the site's "fancy" dates back into datetimes.
+
+The date on each message is rendered for humans, relative to when the page
+was loaded: "Just now", "5 minutes ago", "3:42pm", "Yesterday", "Monday",
+"Oct 12", "Oct 12, 2013". `parse_fancydate` resolves these against the time
+the page was scraped.
+
+The site shows local times, while the database keeps UTC (like
+`datetime.utcnow`), so `fancydate_to_utc` converts on the way in.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import re
+import datetime
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['parse_fancydate', 'fancydate_to_utc']
+
+MONTHS = dict((m, i + 1) for i, m in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun',
+     'jul', 'aug', 'sep', 'oct', 'nov', 'dec']))
+WEEKDAYS = dict((d, i) for i, d in enumerate(
+    ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']))
+
+AGO_RE = re.compile(r'(\d+|an?|one)\s+(second|minute|min|hour|hr|day)s?\s+ago')
+TIME_RE = re.compile(r'(\d{1,2}):(\d{2})(?:\s*([ap])\.?m?\.?)?')
+MONTH_DAY_RE = re.compile(r'([a-z]{3})[a-z]*\.?\s+(\d{1,2})(?:st|nd|rd|th)?'
+                          r'(?:,?\s+(\d{4}))?')
+NUMERIC_RE = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{2,4})')
+WEEKDAY_RE = re.compile(r'\b(mon|tue|wed|thu|fri|sat|sun)[a-z]*\b')
+
+UNITS = {'second': 1, 'minute': 60, 'min': 60, 'hour': 3600, 'hr': 3600,
+         'day': 86400}
+
+##############################################################################
+# Functions
+##############################################################################
+
+
+def parse_fancydate(text, now):
+    """Resolve a fancy date
+
+    Parameters
+    ----------
+    text : str or None
+        What the page showed. None (the date isn't shown on a message
+        that was sent just now) counts as "just now"
+    now : datetime.datetime or None
+        When the page was scraped, in local time. If that isn't known, only
+        dates with a year in them are resolved
+
+    Returns
+    -------
+    timestamp : datetime.datetime or None
+        None if the text can't be made sense of. Dates without a time of
+        day come out at midnight.
+    """
+    if text is None:
+        return now
+    text = text.strip().lower()
+    if text == '' or 'just now' in text or text == 'now':
+        return now
+
+    match = AGO_RE.search(text)
+    if match is not None:
+        if now is None:
+            return None
+        n = match.group(1)
+        n = 1 if n in ('a', 'an', 'one') else int(n)
+        return now - datetime.timedelta(seconds=n * UNITS[match.group(2)])
+
+    match = TIME_RE.search(text)
+    time_of_day = datetime.time(0, 0)
+    if match is not None:
+        hour, minute = int(match.group(1)), int(match.group(2))
+        if match.group(3) is not None:
+            hour = hour % 12 + (12 if match.group(3) == 'p' else 0)
+        if hour > 23 or minute > 59:
+            return None
+        time_of_day = datetime.time(hour, minute)
+
+    date = _absolute_date(text)
+    if date is None and now is not None:
+        date = _relative_date(text, now)
+    if date is None:
+        if match is None or now is None:
+            return None
+        # only a time, so it's from today
+        date = now.date()
+    return datetime.datetime.combine(date, time_of_day)
+
+
+def fancydate_to_utc(text, scraped):
+    """`parse_fancydate` in UTC
+
+    Parameters
+    ----------
+    text : str or None
+    scraped : datetime.datetime or None
+        When the page was scraped, in UTC
+    """
+    # the local UTC offset, to the minute
+    offset = datetime.timedelta(minutes=round(
+        (datetime.datetime.utcnow() -
+         datetime.datetime.now()).total_seconds() / 60))
+    if scraped is not None:
+        scraped = scraped - offset
+    timestamp = parse_fancydate(text, scraped)
+    if timestamp is None:
+        return None
+    return timestamp + offset
+
+
+def _absolute_date(text):
+    match = NUMERIC_RE.search(text)
+    if match is not None:
+        month, day, year = [int(g) for g in match.groups()]
+        if year < 100:
+            year += 2000
+        return _date(year, month, day)
+
+    match = MONTH_DAY_RE.search(text)
+    if match is not None and match.group(1) in MONTHS and \
+            match.group(3) is not None:
+        return _date(int(match.group(3)), MONTHS[match.group(1)],
+                     int(match.group(2)))
+    return None
+
+
+def _relative_date(text, now):
+    today = now.date()
+    if 'today' in text:
+        return today
+    if 'yesterday' in text:
+        return today - datetime.timedelta(days=1)
+
+    match = MONTH_DAY_RE.search(text)
+    if match is not None and match.group(1) in MONTHS:
+        month, day = MONTHS[match.group(1)], int(match.group(2))
+        # no year means within the last twelve months
+        date = _date(today.year, month, day)
+        if date is not None and date > today:
+            date = _date(today.year - 1, month, day)
+        return date
+
+    match = WEEKDAY_RE.search(text)
+    if match is not None:
+        # the most recent one, within the last week
+        days = (today.weekday() - WEEKDAYS[match.group(1)]) % 7
+        return today - datetime.timedelta(days=days)
+
+    return None
+
+
+def _date(year, month, day):
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
@@ -0,0 +1,174 @@
+"""
+Batched edit-distance kernels.
+
+These compute the Levenshtein distance between one target string and a
+whole collection of strings in a single call, vectorizing over the
+collection with numpy instead of running the pure-python dynamic program
+once per pair. The results are exactly the same integers that
+`lib.twitter.levenshtein` returns.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+from itertools import imap
+import numpy as np
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['encode', 'pad', 'batch_levenshtein']
+
+# strings are encoded as arrays of code points. padding is negative, so it
+# never compares equal to a real character
+PAD = -1
+WORD_BITS = 64
+ONE = np.uint64(1)
+ZERO = np.uint64(0)
+
+##############################################################################
+# Functions
+##############################################################################
+
+
+def encode(text):
+    """Encode a string as an int32 array of code points
+
+    Parameters
+    ----------
+    text : str or unicode
+
+    Returns
+    -------
+    codes : np.ndarray, dtype=int32, shape=(len(text),)
+    """
+    return np.fromiter(imap(ord, text), dtype=np.int32, count=len(text))
+
+
+def pad(encoded, width=None):
+    """Stack a list of encoded strings into a padded 2D array
+
+    Parameters
+    ----------
+    encoded : list of np.ndarray
+        The output of `encode` on each string
+    width : int, optional
+        Number of columns. Defaults to the length of the longest string
+
+    Returns
+    -------
+    codes : np.ndarray, dtype=int32, shape=(len(encoded), width)
+        Each row holds one string, padded on the right with `PAD`
+    lengths : np.ndarray, dtype=int64, shape=(len(encoded),)
+        The length of each string
+    """
+    lengths = np.array([len(e) for e in encoded], dtype=np.int64)
+    if width is None:
+        width = lengths.max() if len(lengths) > 0 else 0
+
+    codes = np.empty((len(encoded), width), dtype=np.int32)
+    codes.fill(PAD)
+    for i, e in enumerate(encoded):
+        codes[i, :len(e)] = e
+    return codes, lengths
+
+
+def batch_levenshtein(target, codes, lengths):
+    """Levenshtein distance from one string to many strings at once
+
+    Parameters
+    ----------
+    target : str or unicode
+        The string to compare against
+    codes : np.ndarray, dtype=int32, shape=(n_strings, width)
+        The padded, encoded strings. See `pad`
+    lengths : np.ndarray, dtype=int, shape=(n_strings,)
+        The length of each string in `codes`
+
+    Returns
+    -------
+    distances : np.ndarray, dtype=int64, shape=(n_strings,)
+        distances[i] == levenshtein(target, strings[i])
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    target_codes = encode(target)
+
+    if len(target_codes) == 0 or codes.shape[1] == 0:
+        return np.abs(lengths - len(target_codes))
+    return _myers(target_codes, codes, lengths)
+
+
+def _myers(target_codes, codes, lengths):
+    """Myers' bit-parallel edit distance, in the global-alignment, multi-word
+    block form given by Hyyro (2001). The target is the pattern, split into
+    64 bit blocks; each column of `codes` is one step, vectorized over rows.
+    """
+    m = len(target_codes)
+    n_blocks = (m + WORD_BITS - 1) // WORD_BITS
+    last_shift = np.uint64((m - 1) % WORD_BITS)
+    top_shift = np.uint64(WORD_BITS - 1)
+
+    # longest strings first, so that at column j only the leading rows are
+    # still active and everything else can be sliced away
+    order = np.argsort(-lengths, kind='mergesort')
+    n_active = np.searchsorted(-lengths[order], -np.arange(codes.shape[1]))
+
+    # pattern match masks: bit i of peq[b, k] is set iff
+    # target[b*64 + i] == alphabet[k]. the extra final column is for
+    # characters that are not in the alphabet at all.
+    alphabet, inverse = np.unique(target_codes, return_inverse=True)
+    peq = np.zeros((n_blocks, len(alphabet) + 1), dtype=np.uint64)
+    for i, k in enumerate(inverse):
+        peq[i // WORD_BITS, k] |= ONE << np.uint64(i % WORD_BITS)
+
+    # translate every character into its column of peq with a lookup table,
+    # shifted by one so that padding lands on the "not in alphabet" slot too
+    lookup = np.empty(alphabet[-1] + 3, dtype=np.intp)
+    lookup.fill(len(alphabet))
+    lookup[alphabet + 1] = np.arange(len(alphabet))
+    # column-major, so each step reads contiguous memory
+    codes = np.ascontiguousarray(codes[order].T)
+    index = lookup.take(np.clip(codes + 1, 0, len(lookup) - 1))
+
+    pv = np.empty((n_blocks, len(order)), dtype=np.uint64)
+    pv.fill(~ZERO)
+    mv = np.zeros((n_blocks, len(order)), dtype=np.uint64)
+    score = np.empty(len(order), dtype=np.int64)
+    score.fill(m)
+
+    for j, k in enumerate(n_active):
+        if k == 0:
+            break
+        column = index[j, :k]
+        # the top row is D[0, j] = j, so every column enters the first block
+        # with a horizontal delta of +1
+        hin_pos, hin_neg = ONE, ZERO
+
+        for b in range(n_blocks):
+            pv_b, mv_b = pv[b, :k], mv[b, :k]
+            eq = peq[b].take(column)
+            xv = eq | mv_b
+            eq |= hin_neg
+            xh = (((eq & pv_b) + pv_b) ^ pv_b) | eq
+            ph = mv_b | ~(xh | pv_b)
+            mh = pv_b & xh
+
+            if b == n_blocks - 1:
+                score[:k] += ((ph >> last_shift) & ONE).view(np.int64)
+                score[:k] -= ((mh >> last_shift) & ONE).view(np.int64)
+            else:
+                hout_pos, hout_neg = ph >> top_shift, mh >> top_shift
+
+            ph = (ph << ONE) | hin_pos
+            mh = (mh << ONE) | hin_neg
+            pv_b[:] = mh | ~(xv | ph)
+            mv_b[:] = ph & xv
+
+            if b < n_blocks - 1:
+                hin_pos, hin_neg = hout_pos, hout_neg
+
+    distances = np.empty_like(score)
+    distances[order] = score
+    return distances
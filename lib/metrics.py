@@ -0,0 +1,220 @@
+"""
+Timing and counting what the bot spends its time on.
+
+Phases (navigating, parsing, scraping, ranking, ...) are timed into
+histograms with `timed` (a decorator) or `span` (a context manager), and
+events are tallied with `count`. Everything goes into the module-level
+`REGISTRY`, which `flush` writes out as a Prometheus textfile (for
+node_exporter's textfile collector) and/or appends to a JSON lines log.
+
+Until `configure` turns it on, the registry is disabled and the
+instrumentation costs one attribute check per call.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import os
+import json
+import time
+import bisect
+import functools
+import threading
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['Registry', 'REGISTRY', 'configure', 'timed', 'span', 'count',
+           'flush']
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+PREFIX = 'okbot'
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class _NullSpan(object):
+    "What `span` hands out when the registry is disabled"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Span(object):
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.time() - self.start)
+        return False
+
+
+class Registry(object):
+    """Histograms of phase durations and counters of events. Thread-safe."""
+
+    def __init__(self):
+        self.enabled = False
+        self.textfile = None
+        self.jsonl = None
+
+        self._lock = threading.Lock()
+        # name -> [bucket counts (the last one is +Inf), sum, count]
+        self._histograms = {}
+        self._counters = {}
+
+    def configure(self, textfile=None, jsonl=None, enabled=True):
+        """Turn the registry on (or off), and say where to write to
+
+        Parameters
+        ----------
+        textfile : str, optional
+            Prometheus textfile to rewrite on every `flush`
+        jsonl : str, optional
+            JSON lines file to append a snapshot to on every `flush`
+        enabled : bool
+        """
+        self.textfile = textfile
+        self.jsonl = jsonl
+        self.enabled = enabled
+
+    def observe(self, name, seconds):
+        "Record one duration of the phase `name`"
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+                self._histograms[name] = histogram
+            histogram[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def count(self, name, n=1):
+        "Add `n` to the counter `name`"
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def span(self, name):
+        "Context manager that times its body as the phase `name`"
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name):
+        "Decorator that times every call to a function as the phase `name`"
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.time()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(name, time.time() - start)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """Everything recorded so far
+
+        Returns
+        -------
+        snapshot : dict
+            'time', the 'counters', and for each phase its 'count', 'sum'
+            and cumulative 'buckets' as [[upper bound, count], ...]
+        """
+        with self._lock:
+            phases = {}
+            for name, (buckets, total, n) in self._histograms.items():
+                cumulative, running = [], 0
+                for bound, k in zip(BUCKETS + ('+Inf',), buckets):
+                    running += k
+                    cumulative.append([bound, running])
+                phases[name] = {'count': n, 'sum': total,
+                                'buckets': cumulative}
+            return {'time': time.time(), 'phases': phases,
+                    'counters': dict(self._counters)}
+
+    def flush(self):
+        "Write out everything recorded so far, wherever configured"
+        if not self.enabled:
+            return
+        snapshot = self.snapshot()
+        if self.textfile is not None:
+            write_textfile(self.textfile, snapshot)
+        if self.jsonl is not None:
+            with open(self.jsonl, 'a') as f:
+                f.write(json.dumps(snapshot, sort_keys=True) + '\n')
+
+
+_NULL_SPAN = _NullSpan()
+REGISTRY = Registry()
+
+##############################################################################
+# Functions
+##############################################################################
+
+
+def configure(textfile=None, jsonl=None, enabled=True):
+    "See `Registry.configure`"
+    REGISTRY.configure(textfile=textfile, jsonl=jsonl, enabled=enabled)
+
+
+def timed(name):
+    "See `Registry.timed`"
+    return REGISTRY.timed(name)
+
+
+def span(name):
+    "See `Registry.span`"
+    return REGISTRY.span(name)
+
+
+def count(name, n=1):
+    "See `Registry.count`"
+    REGISTRY.count(name, n)
+
+
+def flush():
+    "See `Registry.flush`"
+    REGISTRY.flush()
+
+
+def write_textfile(filename, snapshot):
+    """Write a snapshot in the Prometheus text format. The file is replaced
+    atomically, so the collector never reads half of it."""
+    lines = ['# TYPE %s_phase_seconds histogram' % PREFIX]
+    for name in sorted(snapshot['phases']):
+        phase = snapshot['phases'][name]
+        for bound, n in phase['buckets']:
+            lines.append('%s_phase_seconds_bucket{phase="%s",le="%s"} %d' %
+                         (PREFIX, name, bound, n))
+        lines.append('%s_phase_seconds_sum{phase="%s"} %r' %
+                     (PREFIX, name, phase['sum']))
+        lines.append('%s_phase_seconds_count{phase="%s"} %d' %
+                     (PREFIX, name, phase['count']))
+    for name in sorted(snapshot['counters']):
+        lines.append('# TYPE %s_%s_total counter' % (PREFIX, name))
+        lines.append('%s_%s_total %d' % (PREFIX, name,
+                                         snapshot['counters'][name]))
+
+    tmp_fn = filename + '.tmp'
+    with open(tmp_fn, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.rename(tmp_fn, filename)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
 from database import Base
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
@@ -8,6 +8,15 @@ class Thread(Base):
     __tablename__ = 'threads'
     id = Column(Integer, primary_key=True)
     okc_id = Column(String, unique=True)
+
+    # incremental sync state: the newest message we've stored, when we last
+    # synced, and a digest of the thread's row on the messages page then
+    last_okc_id = Column(String)
+    synced = Column(DateTime)
+    inbox_digest = Column(String)
+    # username of the account whose inbox it's in, for running several
+    # accounts off one database. Unset for threads from before that
+    account = Column(String, index=True)
     
     def __repr__(self):
         return u'Thread %d, N=%d msgs>' % (self.id, len(self.messages))
@@ -15,13 +24,17 @@ class Thread(Base):
 class Message(Base):
     __tablename__ = 'messages'
     id = Column(Integer, primary_key=True)
-    thread_id = Column(Integer, ForeignKey('threads.id'))
+    thread_id = Column(Integer, ForeignKey('threads.id'), index=True)
     thread = relationship("Thread", backref=backref('messages', order_by=id))
 
     okc_id = Column(String, unique=True)
     body = Column(String)
-    sender = Column(String)
+    sender = Column(String, index=True)
     fancydate = Column(String)
+    # when it was sent, parsed from the fancydate (UTC)
+    timestamp = Column(DateTime, index=True)
+    # when we first stored it
+    logged = Column(DateTime, index=True)
 
     def __repr__(self):
         use_unicode = False
@@ -31,4 +44,32 @@ class Message(Base):
         return ('%s:  %s' % (self.sender, self.body)).encode('utf-8')
         
     #def __str__(self):
-    #    return self.__repr__().
\ No newline at end of file
+    #    return self.__repr__().
+
+
+class Tweet(Base):
+    """A tweet we've pulled, kept so that the bot can warm-start (or run
+    completely offline) from the local corpus. See lib/corpus.py"""
+    __tablename__ = 'tweets'
+    # twitter's id. sqlite integer primary keys are 64 bit
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    raw_text = Column(String)
+    text = Column(String)
+    pulled = Column(DateTime)
+
+    def __repr__(self):
+        return ('<Tweet %d: %s>' % (self.id, self.text)).encode('utf-8')
+
+
+class TumblrPost(Base):
+    """A tumblr post we've pulled, with the same columns as a `Tweet`. See
+    lib/tumblr/tumblr.py"""
+    __tablename__ = 'tumblr_posts'
+    # tumblr's id
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    raw_text = Column(String)
+    text = Column(String)
+    pulled = Column(DateTime)
+
+    def __repr__(self):
+        return ('<TumblrPost %d: %s>' % (self.id, self.text)).encode('utf-8')
@@ -1,14 +1,17 @@
 import time
 import re
-import yaml
+import hashlib
 import logging
 import random
 from collections import namedtuple
-from lxml.html import soupparser
+import lxml.html
+from lxml import etree
 
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
+from transport import LoginError, SeleniumTransport, HTTPTransport
+from ratelimit import TokenBucket
+import metrics
 BASE_URL = 'https://www.okcupid.com%s'
+THREAD_URL = '/messages?readmsg=true&threadid=%s&folder=1'
 
 def sleep(seconds='random'):
     "Sleep a few seconds"
@@ -16,7 +19,26 @@ def sleep(seconds='random'):
     if seconds is 'random':
         time.sleep(random.random())
     else:
-        time.sleep(seconds)
+        time.sleep(max(seconds, 0))
+
+
+def parse_html(source):
+    """Parse a page into an lxml element tree, using the fast lxml parser and
+    falling back to BeautifulSoup if that fails
+
+    Returns
+    -------
+    root : lxml.Element
+    used_soup : bool
+        Whether we had to fall back to BeautifulSoup
+    """
+    try:
+        return lxml.html.fromstring(source), False
+    except (etree.LxmlError, ValueError):
+        logging.info('lxml failed to parse the page, trying BeautifulSoup')
+        # only imported when it's needed, since it's slow to import
+        from lxml.html import soupparser
+        return soupparser.fromstring(source), True
 
 
 def uniqueify(seq, key):
@@ -35,46 +57,131 @@ def uniqueify(seq, key):
     return nodups
 
 
-class LoginError(Exception):
-    pass
-
-
 class OkCupid(object):
     """
-    Selenium-Webdriver based "programmatic" interface to okcupid, since they
-    don't actually have an API. Currently, it has only minimal functionality.
+    Selenium-Webdriver or plain HTTP based "programmatic" interface to
+    okcupid, since they don't actually have an API. Currently, it has only
+    minimal functionality.
     """
 
-    def __init__(self, username, password, browser='chrome'):
-
-        browser_switch = {'chrome': webdriver.Chrome,
-                        'firefox': webdriver.Firefox}
-        try:
-            self._browser = browser_switch[browser]()
-        except KeyError:
-            raise KeyError('Browser must be one of %s' % browser_switch.keys())
+    def __init__(self, username, password, browser='chrome', base_url=BASE_URL,
+                 limiter=None):
+        """
+        Parameters
+        ----------
+        username : str
+        password : str
+        browser : {'chrome', 'firefox', 'http'} or transport
+            Which transport to use (see lib/transport.py). 'http' skips the
+            browser entirely and talks to the site with requests.
+        base_url : str
+            Format string for turning paths into urls. Point this at a
+            local stand-in server for testing.
+        limiter : ratelimit.TokenBucket, optional
+            Every request to the site waits on this. Share one between
+            instances to cap their combined request rate.
+        """
+        self.browser = browser
+        if browser == 'http':
+            self._browser = HTTPTransport()
+        elif isinstance(browser, basestring):
+            self._browser = SeleniumTransport(browser)
+        else:
+            self._browser = browser
+        self.base_url = base_url
+        if limiter is None:
+            limiter = TokenBucket()
+        self.limiter = limiter
         
         self.username = username
         self.password = password
         self._logged_in = False
 
-        self._root_soup_element_url = None
-        self._root_soup_element = None
+        # parsed DOM of the current page, and the (url, source hash) it
+        # was parsed from
+        self._dom_key = None
+        self._dom = None
+        self.parse_stats = {'hits': 0, 'misses': 0, 'soup_fallbacks': 0,
+                            'parse_seconds': 0.0}
 
     def __del__(self):
         self._browser.close()
 
+    @metrics.timed('navigate_to')
     def navigate_to(self, url, force_refresh=False):
         "Move the browser to a new url"
         
         if not (url.startswith('http://') or url.startswith('https://')):
-            url = BASE_URL % url
+            url = self.base_url % url
         
         logging.info('Nativating to: %s', url)
         if (self._browser.current_url != url) or force_refresh:
-            self._browser.get(url)
-        sleep()
+            self._request(self._browser.get, url)
+            metrics.count('pages_loaded')
+
+    def _request(self, method, *args, **kwargs):
+        "Call a transport method that hits the site, under the rate limiter"
+        self.limiter.acquire()
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            self.limiter.failure()
+            raise
+        self.limiter.success()
+        return result
+
+    def spawn(self):
+        """Another OkCupid on the same account, sharing this one's rate
+        limiter, for scraping in parallel. With the HTTP transport it also
+        shares the session (and so the login), otherwise it opens another
+        browser and logs in again.
+        """
+        if isinstance(self._browser, HTTPTransport):
+            transport = HTTPTransport(session=self._browser.session)
+            bot = OkCupid(self.username, self.password, browser=transport,
+                          base_url=self.base_url, limiter=self.limiter)
+            bot._logged_in = self._logged_in
+        else:
+            bot = OkCupid(self.username, self.password, browser=self.browser,
+                          base_url=self.base_url, limiter=self.limiter)
+            if self._logged_in:
+                bot.login()
+        return bot
+
+    def document(self, force_rebuild=False):
+        """The parsed DOM of the current page
+
+        The tree is cached until the url or the page source changes.
+
+        Parameters
+        ----------
+        force_rebuild : bool, optional
+            Should we necessarily rebuild the element tree?
 
+        Returns
+        -------
+        root : lxml.Element
+        """
+        source = self._browser.page_source
+        if isinstance(source, unicode):
+            digest = hashlib.md5(source.encode('utf-8')).hexdigest()
+        else:
+            digest = hashlib.md5(source).hexdigest()
+        key = (self._browser.current_url, digest)
+
+        if force_rebuild or key != self._dom_key:
+            start = time.time()
+            self._dom, used_soup = parse_html(source)
+            self._dom_key = key
+            self.parse_stats['misses'] += 1
+            self.parse_stats['soup_fallbacks'] += used_soup
+            self.parse_stats['parse_seconds'] += time.time() - start
+        else:
+            self.parse_stats['hits'] += 1
+
+        return self._dom
+
+    @metrics.timed('xpath')
     def xpath(self, selector, force_rebuild=False):
         """Run the LXML/BeautifulSoup xpath engine
         
@@ -89,10 +196,7 @@ class OkCupid(object):
         -------
         elem : [lxml.Element]
         """
-        if force_rebuild or (self._root_soup_element_url != self._browser.current_url):
-            self._root_soup_element = soupparser.fromstring(self._browser.page_source)
-
-        return self._root_soup_element.xpath(selector)
+        return self.document(force_rebuild).xpath(selector)
 
     def xpath0(self, selector, force_rebuild=False):
         """Get a single element with xpath
@@ -114,16 +218,7 @@ class OkCupid(object):
 
         logging.info('"%s" logging into OkCupid', self.username)
         self.navigate_to('/login')
-        elem = self._browser.find_element_by_xpath('//*[@id="user"]')
-        elem.send_keys(self.username)
-        elem = self._browser.find_element_by_xpath('//*[@id="pass"]')
-        elem.send_keys(self.password)
-        elem = self._browser.find_element_by_xpath('//*[@id="login_form"]/p/a')
-        elem.click()
-
-        while not 'Welcome' in self._browser.title:
-            logging.info('Waiting on load...')
-            sleep(2)
+        self._request(self._browser.login, self.username, self.password)
 
         logging.info('title: %s', self._browser.title)
 
@@ -142,28 +237,59 @@ class OkCupid(object):
         thread_ids : list of strings
             List of thread_id for each thread
         """
+        return [tid for tid, digest in self.get_thread_summaries(classes)]
+
+    def get_thread_summaries(self, classes=None):
+        """Get the id of every thread on the messages page, along with a
+        digest of its row, which changes whenever something new arrives in
+        the thread (the snippet is in the row).
+
+        The digest covers the thread id, the snippet and whether the row is
+        read or unread, but not the date: it's relative ("5 minutes ago",
+        "Yesterday"), so it changes on its own as time passes.
+
+        Parameters
+        ----------
+        cls : list of classes or a single class
+
+        Return
+        ------
+        summaries : list of (thread_id, digest)
+        """
         logging.info('Getting all threads')
         
         if not self._logged_in:
             raise LoginError('Not Logged In')
-        self.navigate_to('/messages')
+        # always reloaded, since the browser may still be on the messages
+        # page from the last time
+        self.navigate_to('/messages', force_refresh=True)
         
         if isinstance(classes, basestring):
             classes = [classes]
         
-        def thread_ids_on_page():
+        def summaries_on_page():
             if classes is None:
-                threads = self.xpath('//*[@id="messages"]/li//p/@onclick')
-                
-            threads = []
-            for cls in classes:
-                xstring = '//*[@id="messages"]/li[@class="%s"]//p/@onclick' % cls
-                threads += self.xpath(xstring)
-
-            return [re.search('\d+', e).group(0) for e in threads]
+                items = self.xpath('//*[@id="messages"]/li')
+            else:
+                items = []
+                for cls in classes:
+                    xstring = '//*[@id="messages"]/li[@class="%s"]' % cls
+                    items += self.xpath(xstring)
+
+            summaries = []
+            for item in items:
+                snippet = item.xpath('.//p[@onclick]')
+                if len(snippet) == 0:
+                    continue
+                tid = re.search('\d+', snippet[0].get('onclick')).group(0)
+                text = u'\n'.join([tid, item.get('class', u''),
+                                   snippet[0].text_content()])
+                summaries.append((tid, hashlib.md5(text.encode('utf-8'))
+                                  .hexdigest()))
+            return summaries
         
         
-        all_ids = thread_ids_on_page()
+        all_summaries = summaries_on_page()
         
         
         # need to deal with the pagination
@@ -175,11 +301,12 @@ class OkCupid(object):
             else:
                 logging.info('Going to Next')
                 self.navigate_to(next.attrib['href'])
-                all_ids += thread_ids_on_page()
+                all_summaries += summaries_on_page()
 
-        return all_ids
+        return all_summaries
 
 
+    @metrics.timed('reply_to_thread')
     def reply_to_thread(self, thread_id, content, dry_run=False):
         """Reply to a message thread
 
@@ -194,25 +321,23 @@ class OkCupid(object):
         if not self._logged_in:
             raise LoginError('Not Logged In')
 
-        thread_url = 'http://www.okcupid.com/messages' + \
-            '?readmsg=true&threadid=%s&folder=1' % thread_id
-        self.navigate_to(thread_url)
-
-        message_box = self._browser.find_element_by_xpath('//*[@id="message_text"]')
-        message_box.send_keys(content)
-
-        send_button = self._browser.find_element_by_xpath('//*[@id="send_button"]/a')
+        self.navigate_to(THREAD_URL % thread_id)
+        if dry_run:
+            self._browser.send_message(content, dry_run=True)
+        else:
+            self._request(self._browser.send_message, content)
 
-        if not dry_run:
-            send_button.click()
-
-    def scrape_thread(self, thread_id):
-        """Scrape all of the messages in a conversation thread
+    @metrics.timed('scrape_thread')
+    def scrape_thread(self, thread_id, after=None):
+        """Scrape the messages in a conversation thread
 
         Parameters
         ----------
         threadid : int
             The id of the thread to scrape
+        after : str, optional
+            The id of a message we already have. Only the messages after it
+            are parsed and returned. If it isn't in the thread, everything is.
 
         Returns
         -------
@@ -220,9 +345,7 @@ class OkCupid(object):
             List of dicts, representing the messages. Each msg contains
             'id', 'sender', 'body', 'time'
         """
-        thread_url = 'http://www.okcupid.com/messages' + \
-            '?readmsg=true&threadid=%s&folder=1' % thread_id
-        self.navigate_to(thread_url)
+        self.navigate_to(THREAD_URL % thread_id)
 
         def parse_msg(elem):
             id = elem.attrib['id']
@@ -251,11 +374,22 @@ class OkCupid(object):
             return {'id': id, 'sender': sender, 'body': body, 'fancydate': fancydate}
 
         message_items = self.xpath('//ul[@id="thread"]/li')
+        if after is not None:
+            # walk back from the end until we hit the message we already have
+            stop = 'message_%s' % after
+            tail = []
+            for e in reversed(message_items):
+                if e.attrib.get('id') == stop:
+                    break
+                tail.append(e)
+            message_items = tail[::-1]
+
         # run parse_msg on each entry, but remove the None entries
         return [e for e in [parse_msg(e) for e in message_items] if e is not None]
 
 
 def test1():
+    import yaml
     with open('settings.yml') as f:
         settings = yaml.load(f)
         username = settings['okcupid']['username']
@@ -0,0 +1,307 @@
+"""
+Incremental q-gram index for nearest-neighbor search under normalized
+Levenshtein distance.
+
+Every string is stored with its q-gram profile in an inverted index. A
+query counts the q-grams each stored string shares with the target, which
+together with the lengths gives a lower bound on the edit distance (the
+q-gram lemma). Single characters are always indexed as well, since for
+q = 1 the lemma gives the much tighter "bag distance" bound. Only strings
+whose lower bound could beat the best distance found so far are verified
+with the exact distance kernel.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+from __future__ import division
+import numpy as np
+
+from distance import encode, pad, batch_levenshtein
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['QGramIndex']
+
+# code points are < 0x110000, so q-grams for q <= 3 pack into one int64
+CODE_BASE = 0x110000
+MAX_Q = 3
+
+##############################################################################
+# Functions
+##############################################################################
+
+
+def qgrams(codes, q):
+    """The q-gram profile of an encoded string
+
+    Parameters
+    ----------
+    codes : np.ndarray, dtype=int32
+        The output of `distance.encode`
+    q : int
+        Length of the grams
+
+    Returns
+    -------
+    grams : np.ndarray, dtype=int64
+        The distinct q-grams, each packed into a single integer
+    counts : np.ndarray, dtype=int64
+        Number of occurrences of each gram
+    """
+    n = len(codes) - q + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    packed = np.zeros(n, dtype=np.int64)
+    for i in range(q):
+        packed = packed * CODE_BASE + codes[i:i + n]
+    return np.unique(packed, return_counts=True)
+
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class QGramIndex(object):
+    """A set of strings, searchable by normalized Levenshtein distance.
+
+    The distance from a target to a string is
+    levenshtein(target.lower(), text.lower()) / len(text), and empty strings
+    are infinitely far from everything. This is the ranking used by
+    `twitter.SortedTweeterator`.
+
+    Each string is stored in a slot, numbered in insertion order. Removed
+    slots are tombstoned and the index is compacted once most of it is dead.
+    Ties in distance go to the earliest inserted string.
+    """
+    batch_size = 64
+
+    def __init__(self, q=2):
+        """Create an empty index
+
+        Parameters
+        ----------
+        q : int
+            Length of the q-grams. Must be at most 3.
+        """
+        if not 1 <= q <= MAX_Q:
+            raise ValueError('q must be between 1 and %d' % MAX_Q)
+        self.q = q
+        self._gram_lengths = sorted(set([1, q]))
+        self._clear()
+
+    def _clear(self):
+        self._slots = {}           # key -> slot
+        self._keys = []            # slot -> key
+        self._codes = []           # slot -> encoded, lowercased text
+        self._lengths = np.zeros(16, dtype=np.int64)
+        self._text_lengths = np.zeros(16, dtype=np.int64)
+        self._alive = np.zeros(16, dtype=bool)
+        # q -> gram -> [slots, counts, n], with room to grow past n
+        self._postings = dict((q, {}) for q in self._gram_lengths)
+        self._n_alive = 0
+
+    def __len__(self):
+        return self._n_alive
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def add(self, key, text, features=None):
+        """Add a string to the index. Adding a key that is already present
+        does nothing.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies the string, e.g. the tweet id
+        text : str
+            The string itself
+        features : dict, optional
+            Precomputed 'codes' of the lowercased text and 'length' of the
+            text, see `twitter.features`. The text isn't kept, so with both
+            of these it may be None
+        """
+        if key in self._slots:
+            return
+
+        slot = len(self._keys)
+        if slot == len(self._alive):
+            for name in ('_lengths', '_text_lengths', '_alive'):
+                old = getattr(self, name)
+                new = np.zeros(2 * len(old), dtype=old.dtype)
+                new[:len(old)] = old
+                setattr(self, name, new)
+
+        features = features or {}
+        codes = features.get('codes')
+        if codes is None:
+            codes = encode(text.lower())
+        text_length = features.get('length')
+        if text_length is None:
+            text_length = len(text)
+        self._slots[key] = slot
+        self._keys.append(key)
+        self._codes.append(codes)
+        self._lengths[slot] = len(codes)
+        self._text_lengths[slot] = text_length
+        self._alive[slot] = True
+        self._n_alive += 1
+
+        for q, postings in self._postings.items():
+            grams, counts = qgrams(codes, q)
+            for gram, count in zip(grams.tolist(), counts.tolist()):
+                entry = postings.get(gram)
+                if entry is None:
+                    entry = postings[gram] = [np.zeros(4, dtype=np.int64),
+                                              np.zeros(4, dtype=np.int64), 0]
+                elif entry[2] == len(entry[0]):
+                    entry[0] = np.concatenate([entry[0], entry[0]])
+                    entry[1] = np.concatenate([entry[1], entry[1]])
+                entry[0][entry[2]] = slot
+                entry[1][entry[2]] = count
+                entry[2] += 1
+
+    def remove(self, key):
+        """Remove a string from the index
+
+        Parameters
+        ----------
+        key : hashable
+            The key it was added with. Raises KeyError if it isn't present.
+        """
+        slot = self._slots.pop(key)
+        self._alive[slot] = False
+        self._codes[slot] = None
+        self._n_alive -= 1
+
+        n_dead = len(self._keys) - self._n_alive
+        if n_dead > 1024 and n_dead > self._n_alive:
+            self._compact()
+
+    def _compact(self):
+        "Rebuild the index without the tombstoned slots"
+        live = [(self._keys[s], {'codes': self._codes[s],
+                                 'length': self._text_lengths[s]})
+                for s in np.flatnonzero(self._alive[:len(self._keys)])]
+        self._clear()
+        for key, features in live:
+            self.add(key, None, features)
+
+    def nearest(self, target, k=1):
+        """Find the k strings closest to the target
+
+        Parameters
+        ----------
+        target : str
+            The string to search for
+        k : int
+            How many neighbors to return
+
+        Returns
+        -------
+        neighbors : list of (key, distance)
+            The min(k, len(self)) nearest strings, closest first
+        """
+        n_slots = len(self._keys)
+        k = min(k, self._n_alive)
+        if k <= 0:
+            return []
+
+        target = target.lower()
+        bound = self._lower_bounds(encode(target), n_slots)
+
+        distances = np.empty(n_slots)
+        distances.fill(np.inf)
+        verified = np.zeros(n_slots, dtype=bool)
+
+        # verify a first batch of the most promising strings, then everything
+        # whose lower bound doesn't rule it out against the k-th best so far
+        n_first = min(max(k, self.batch_size), n_slots)
+        if n_first < n_slots:
+            candidates = np.argpartition(bound, n_first - 1)[:n_first]
+        else:
+            candidates = np.arange(n_slots)
+        candidates = candidates[np.isfinite(bound[candidates])]
+        self._verify(target, candidates, distances, verified)
+
+        kth = np.partition(distances, k - 1)[k - 1]
+        candidates = np.flatnonzero((bound <= kth) & np.isfinite(bound) &
+                                    ~verified)
+        self._verify(target, candidates, distances, verified)
+
+        # empty strings are never verified, but are still neighbors if there
+        # is nothing else left
+        order = np.lexsort((np.arange(n_slots), distances))
+        order = order[self._alive[order]][:k]
+        return [(self._keys[s], distances[s]) for s in order]
+
+    def distances(self, target, keys):
+        """The distances from the target to some of the strings
+
+        Parameters
+        ----------
+        target : str
+        keys : list of hashable
+            Keys of strings in the index. Raises KeyError for any that isn't.
+
+        Returns
+        -------
+        distances : np.ndarray
+            In the same order as the keys
+        """
+        slots = np.array([self._slots[key] for key in keys], dtype=np.int64)
+        distances = np.empty(len(slots))
+        distances.fill(np.inf)
+        usable = self._text_lengths[slots] > 0
+        if np.any(usable):
+            codes, lengths = pad([self._codes[s] for s in slots[usable]])
+            distances[usable] = (batch_levenshtein(target.lower(), codes,
+                                                   lengths) /
+                                 self._text_lengths[slots[usable]])
+        return distances
+
+    def _lower_bounds(self, target_codes, n_slots):
+        "Lower bound on the normalized distance from the target to each slot"
+        m = len(target_codes)
+        lengths = self._lengths[:n_slots]
+        longest = np.maximum(lengths, m)
+
+        # an edit changes the length by at most one
+        bound = np.abs(lengths - m)
+
+        for q, postings in self._postings.items():
+            # number of q-grams shared with the target (as multisets)
+            shared = np.zeros(n_slots, dtype=np.int64)
+            grams, counts = qgrams(target_codes, q)
+            for gram, count in zip(grams.tolist(), counts.tolist()):
+                if gram in postings:
+                    slots, slot_counts, n = postings[gram]
+                    shared[slots[:n]] += np.minimum(slot_counts[:n], count)
+
+            # each edit destroys at most q of the max(n, m) - q + 1 grams in
+            # the longer string
+            by_grams = -((shared - longest + q - 1) // q)
+            bound = np.maximum(bound, by_grams)
+
+        text_lengths = self._text_lengths[:n_slots]
+        usable = self._alive[:n_slots] & (text_lengths > 0)
+        normalized = np.empty(n_slots)
+        normalized.fill(np.inf)
+        normalized[usable] = bound[usable] / text_lengths[usable]
+        return normalized
+
+    def _verify(self, target, slots, distances, verified):
+        "Fill in the exact distance for some slots"
+        slots = slots[~verified[slots]]
+        if len(slots) == 0:
+            return
+        codes, lengths = pad([self._codes[s] for s in slots])
+        dists = batch_levenshtein(target, codes, lengths)
+        distances[slots] = dists / self._text_lengths[slots]
+        verified[slots] = True
@@ -0,0 +1,90 @@
+"""
+Rate limiting for requests to the site.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import time
+import random
+import threading
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['TokenBucket']
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket, shared by everything that talks to the site.
+
+    Tokens accrue at `rate` per second, up to `burst`. Each request takes
+    one, waiting for it if the bucket is empty, plus a random jitter of up
+    to `jitter` of the interval between tokens so that the requests don't
+    arrive on a perfectly regular beat.
+
+    After a failed request, `failure` pauses the whole bucket, doubling the
+    pause each time, until a request succeeds again.
+    """
+
+    def __init__(self, rate=1.0, burst=1, jitter=0.5, max_backoff=300):
+        """
+        Parameters
+        ----------
+        rate : float
+            Requests per second
+        burst : int
+            How many requests can go out back to back after an idle spell
+        jitter : float
+            Extra random delay per request, as a fraction of 1 / rate
+        max_backoff : float
+            Longest pause after repeated failures, in seconds
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._last = time.time()
+        self._paused_until = 0.0
+        self._backoff = 0.0
+
+    def acquire(self):
+        "Block until a request is allowed to go out"
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+        if self.jitter > 0:
+            time.sleep(random.uniform(0, self.jitter / self.rate))
+
+    def success(self):
+        "Report a successful request, which ends any backoff"
+        with self._lock:
+            self._backoff = 0.0
+
+    def failure(self):
+        "Report a failed request, pausing the bucket for a while"
+        with self._lock:
+            self._backoff = min(max(2 * self._backoff, 1 / self.rate),
+                                self.max_backoff)
+            self._paused_until = time.time() + self._backoff
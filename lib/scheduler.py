@@ -0,0 +1,116 @@
+"""
+Deciding how long to wait between polls of the inbox.
+
+Messages don't arrive on a fixed beat: there are bursts (an evening when
+the profile gets noticed) and long quiet spells. `PollScheduler` estimates
+the recent arrival rate from the timestamps of the incoming messages in
+the database, and polls about once per expected arrival while
+messages are coming in. While nothing comes in, it backs off exponentially
+instead. Either way the interval stays between a floor and a ceiling.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import random
+import datetime
+
+from sqlalchemy import or_
+
+import models
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['PollScheduler']
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class PollScheduler(object):
+    """Adaptive interval between polls, in seconds"""
+
+    def __init__(self, initial=3600, floor=60, ceiling=3 * 3600,
+                 window=2 * 3600, backoff=2.0, jitter=0.2):
+        """
+        Parameters
+        ----------
+        initial : float
+            The interval to start from, before anything has been seen
+        floor, ceiling : float
+            Bounds on the interval
+        window : float
+            How far back to look when estimating the arrival rate
+        backoff : float
+            Factor to grow the interval by after each idle poll
+        jitter : float
+            Random spread of the interval, as a fraction of it, so that the
+            polls don't happen on a perfectly regular beat
+        """
+        if not 0 < floor <= ceiling:
+            raise ValueError('Need 0 < floor <= ceiling, got %s and %s' %
+                             (floor, ceiling))
+        self.floor = float(floor)
+        self.ceiling = float(ceiling)
+        self.window = float(window)
+        self.backoff = backoff
+        self.jitter = jitter
+        self.interval = self._clamp(initial)
+
+    def arrival_rate(self, session, username, now=None):
+        """Incoming messages per second over the last `window`, in the
+        threads of one account
+
+        Several accounts can share the database, so only the threads
+        recorded as this account's count, plus any from before threads were
+        recorded with their account.
+
+        Parameters
+        ----------
+        session : sqlalchemy session
+        username : str
+            Our own username, so that our replies don't count
+        now : datetime.datetime, optional
+            Defaults to utcnow
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        since = now - datetime.timedelta(seconds=self.window)
+        count = session.query(models.Message).join(models.Thread).filter(
+            or_(models.Thread.account == username,
+                models.Thread.account == None),
+            models.Message.timestamp > since,
+            models.Message.sender != username).count()
+        return count / self.window
+
+    def next_interval(self, session, username, now=None):
+        """How long to wait before the next poll. Call once after each poll.
+
+        Parameters
+        ----------
+        session : sqlalchemy session
+        username : str
+            Our own username, so that our replies don't count
+        now : datetime.datetime, optional
+            Defaults to utcnow
+
+        Returns
+        -------
+        seconds : float
+            Between `floor` and `ceiling`
+        """
+        rate = self.arrival_rate(session, username, now)
+        if rate > 0:
+            self.interval = self._clamp(1.0 / rate)
+        else:
+            self.interval = self._clamp(self.interval * self.backoff)
+
+        spread = random.uniform(-self.jitter, self.jitter)
+        return self._clamp(self.interval * (1 + spread))
+
+    def _clamp(self, seconds):
+        return min(max(seconds, self.floor), self.ceiling)
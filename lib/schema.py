@@ -0,0 +1,17 @@
+"""
+What's shared between lib/database.py and the scripts that talk to sqlite
+directly (console.py), without importing SQLAlchemy.
+"""
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['DATABASE_FILE', 'SCHEMA_VERSION']
+
+# relative to the working directory
+DATABASE_FILE = 'database.sqlite'
+
+# the database's PRAGMA user_version once `database.migrate` has brought it
+# up to date. Bumped whenever `migrate` learns a new one-off data migration
+SCHEMA_VERSION = 2
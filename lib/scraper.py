@@ -0,0 +1,105 @@
+"""
+Scraping many message threads at once.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import Queue
+import logging
+import threading
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['ScrapePool']
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class ScrapePool(object):
+    """A pool of `okcupid.OkCupid` workers on the same account that scrape
+    threads concurrently.
+
+    The workers should share one `ratelimit.TokenBucket` (`OkCupid.spawn`
+    takes care of that), so that together they use the allowed request
+    budget without going over it.
+    """
+    max_attempts = 3
+
+    def __init__(self, bots):
+        """
+        Parameters
+        ----------
+        bots : list of okcupid.OkCupid
+            Logged in workers. Each is only ever used by one thread at a time.
+        """
+        self.bots = bots
+
+    @classmethod
+    def spawn(cls, cupidbot, n_workers):
+        """Make a pool of `n_workers`, with `cupidbot` as the first one and
+        the rest spawned from it"""
+        bots = [cupidbot] + [cupidbot.spawn() for i in range(n_workers - 1)]
+        return cls(bots)
+
+    def scrape(self, jobs):
+        """Scrape a bunch of threads
+
+        Parameters
+        ----------
+        jobs : list of (thread_id, after)
+            The arguments for `OkCupid.scrape_thread`
+
+        Returns
+        -------
+        messages : dict
+            Maps each thread id to its scraped messages. A thread that still
+            fails after `max_attempts` tries is logged and left out.
+        """
+        return dict(self.iscrape(jobs))
+
+    def iscrape(self, jobs):
+        """Like `scrape`, but yield each (thread_id, messages) as soon as
+        it's been scraped, so that the caller can get going on it while the
+        rest are still being fetched"""
+        queue = Queue.Queue()
+        for job in jobs:
+            queue.put((job, 1))
+        done = Queue.Queue()
+
+        def work(bot):
+            while True:
+                try:
+                    (tid, after), attempt = queue.get_nowait()
+                except Queue.Empty:
+                    return
+
+                try:
+                    done.put((tid, bot.scrape_thread(tid, after=after)))
+                except Exception:
+                    if attempt < self.max_attempts:
+                        logging.warning('Scraping thread %s failed, retrying',
+                                        tid, exc_info=True)
+                        queue.put(((tid, after), attempt + 1))
+                    else:
+                        logging.exception('Giving up on thread %s', tid)
+                        done.put((tid, None))
+
+        workers = [threading.Thread(target=work, args=(bot,))
+                   for bot in self.bots[:max(len(jobs), 1)]]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        for i in range(len(jobs)):
+            tid, messages = done.get()
+            if messages is not None:
+                yield tid, messages
+
+        for worker in workers:
+            worker.join()
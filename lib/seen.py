@@ -0,0 +1,181 @@
+"""
+Persistent set of the tweet ids that have already been dispensed.
+
+The ids live in two files next to the old flat text file:
+
+  <filename>.sorted  sorted, unique int64 array, memory-mapped on load
+  <filename>.log     raw int64 ids appended since the last compaction
+
+Membership is a binary search in the sorted array plus a set lookup in the
+(small) log. Appends are buffered and fsync'd in batches, and the log is
+merged into the sorted array once it gets long.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import os
+import atexit
+import logging
+import numpy as np
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['SeenIds']
+
+DTYPE = np.dtype('<i8')
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class SeenIds(object):
+    """Set of integer ids, persisted to disk.
+
+    If `filename` is an old-style text file with one id per line (what
+    `Tweeterator` used to write) and there's no sorted array yet, its
+    contents are migrated the first time the store is opened. The text file
+    itself is left alone.
+    """
+    flush_every = 64
+    compact_every = 4096
+
+    def __init__(self, filename):
+        """Open (or create) the store
+
+        Parameters
+        ----------
+        filename : str
+            Base filename. The data goes in `filename + '.sorted'` and
+            `filename + '.log'`
+        """
+        self.filename = filename
+        self.sorted_fn = filename + '.sorted'
+        self.log_fn = filename + '.log'
+
+        if not os.path.exists(self.sorted_fn):
+            self._migrate()
+
+        self._sorted = self._load_sorted()
+        self._recent = set(self._load_log().tolist())
+        self._n_pending = 0
+        self._min = self._max = None
+        self._update_extrema(self._sorted[:1].tolist() +
+                             self._sorted[-1:].tolist() + list(self._recent))
+
+        self._log = open(self.log_fn, 'ab')
+        if len(self._recent) > self.compact_every:
+            self.compact()
+        atexit.register(self.flush)
+
+    def __len__(self):
+        return len(self._sorted) + len(self._recent)
+
+    def __contains__(self, tweet_id):
+        if tweet_id in self._recent:
+            return True
+        i = np.searchsorted(self._sorted, tweet_id)
+        return i < len(self._sorted) and self._sorted[i] == tweet_id
+
+    def add(self, tweet_id):
+        """Add an id to the set. It's written out at the next flush
+
+        Parameters
+        ----------
+        tweet_id : int
+        """
+        if tweet_id in self:
+            return
+        self._recent.add(tweet_id)
+        self._update_extrema([tweet_id])
+        self._log.write(np.array([tweet_id], dtype=DTYPE).tostring())
+        self._n_pending += 1
+
+        if self._n_pending >= self.flush_every:
+            self.flush()
+        if len(self._recent) > self.compact_every:
+            self.compact()
+
+    def min(self):
+        "Smallest id in the set, or None if it's empty"
+        return self._min
+
+    def max(self):
+        "Largest id in the set, or None if it's empty"
+        return self._max
+
+    def flush(self):
+        "Write the buffered ids to the log and fsync it"
+        if self._log.closed:
+            return
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._n_pending = 0
+
+    def compact(self):
+        """Merge the log into the sorted array
+
+        The new array is written to a temporary file and renamed over the old
+        one, so a crash leaves either the old or the new version in place.
+        """
+        self.flush()
+        merged = np.union1d(np.asarray(self._sorted),
+                            np.array(sorted(self._recent), dtype=DTYPE))
+        self._write_sorted(merged)
+
+        self._log.close()
+        self._log = open(self.log_fn, 'wb')
+        self._sorted = self._load_sorted()
+        self._recent = set()
+        logging.info('compacted %d seen tweet ids', len(merged))
+
+    def close(self):
+        "Flush and close the log"
+        self.flush()
+        self._log.close()
+
+    def _update_extrema(self, ids):
+        for i in ids:
+            if self._min is None or i < self._min:
+                self._min = i
+            if self._max is None or i > self._max:
+                self._max = i
+
+    def _migrate(self):
+        "Convert the old flat text file, if there is one"
+        ids = np.zeros(0, dtype=DTYPE)
+        if os.path.exists(self.filename):
+            ids = np.unique(np.loadtxt(self.filename, dtype=DTYPE, ndmin=1))
+            logging.info('migrating %d seen tweet ids from %s', len(ids),
+                         self.filename)
+        self._write_sorted(ids)
+
+    def _write_sorted(self, ids):
+        tmp_fn = self.sorted_fn + '.tmp'
+        with open(tmp_fn, 'wb') as f:
+            ids.astype(DTYPE).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_fn, self.sorted_fn)
+
+    def _load_sorted(self):
+        if os.path.getsize(self.sorted_fn) == 0:
+            return np.zeros(0, dtype=DTYPE)
+        return np.memmap(self.sorted_fn, dtype=DTYPE, mode='r')
+
+    def _load_log(self):
+        if not os.path.exists(self.log_fn):
+            return np.zeros(0, dtype=DTYPE)
+        with open(self.log_fn, 'rb') as f:
+            data = f.read()
+
+        # a crash in the middle of a write can leave a partial id at the end
+        size = len(data) - len(data) % DTYPE.itemsize
+        if size != len(data):
+            with open(self.log_fn, 'r+b') as f:
+                f.truncate(size)
+        return np.frombuffer(data[:size], dtype=DTYPE)
@@ -0,0 +1,337 @@
+"""
+A local stand-in for the OkCupid site, for load testing the bot without an
+account (see loadtest.py).
+
+It serves generated pages in the same shape as the site's, as far as
+`okcupid.OkCupid` and the transports look at them: the login form, the
+messages page (paginated with an `li.next` link, rows marked
+`unreadMessage` or `readMessage`), and thread pages with a reply box.
+Replies are kept, so they show up in the thread and the inbox afterwards.
+
+Threads are generated from the seed each time they're served, rather than
+being kept around, so that 10k threads with 500 messages each cost no
+memory. Every request can be delayed, and made to fail some of the time, to
+see how the bot copes with a slow or flaky site.
+
+    python lib/standin.py --threads 10000 --messages 500 --latency 0.05
+
+and point the bot at it with a `base_url` of 'http://127.0.0.1:5000%s'.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import time
+import random
+import logging
+import argparse
+import threading
+from cgi import escape
+
+import numpy as np
+from flask import Flask, request, session, redirect, abort, jsonify
+from werkzeug.serving import make_server
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['Site', 'make_app', 'serve']
+
+WORDS = ('hey hi hello so what are you up to this weekend i love dogs cats '
+         'coffee tea wine beer hiking running books music movies travel '
+         'food pizza tacos sushi the a and but or not really very much lol '
+         'haha nice cool great awesome sure maybe yes no why how when where '
+         'tonight tomorrow today work job city park beach show concert game '
+         'would could should want like see meet chat talk sounds fun').split()
+
+MONTHS = ('Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec').split()
+
+PAGE = ('<html><head><title>%s</title></head><body>%s</body></html>')
+
+LOGIN_FORM = ('<form id="login_form" method="post" action="/login">'
+              '<input id="user" name="username" type="text">'
+              '<input id="pass" name="password" type="password">'
+              '<input name="dest" type="hidden" value="/home">'
+              '<p><a href="#" onclick="this.parentNode.parentNode.submit()">'
+              'Log in</a></p></form>')
+
+##############################################################################
+# Functions
+##############################################################################
+
+
+def _words(rng, n):
+    return ' '.join(rng.choice(WORDS, n))
+
+
+def _fancydate(rng):
+    return '%s %d, 2013' % (MONTHS[rng.randint(12)], 1 + rng.randint(28))
+
+
+def make_app(site, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+    """The Flask app serving a site
+
+    Parameters
+    ----------
+    site : Site
+    latency : float
+        Seconds to wait before answering each request
+    jitter : float
+        Up to this many more seconds, at random
+    error_rate : float
+        Fraction of the requests to fail with a 503
+    seed : int, optional
+        For the delays and the errors
+
+    Returns
+    -------
+    app : flask.Flask
+    """
+    app = Flask(__name__)
+    app.secret_key = 'standin'
+    rng = random.Random(seed)
+
+    @app.before_request
+    def inject():
+        if request.path == '/stats':
+            return
+        site.count('requests')
+        delay = latency + rng.uniform(0, jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if rng.random() < error_rate:
+            site.count('errors')
+            abort(503)
+
+    @app.route('/login', methods=['GET', 'POST'])
+    def login():
+        if request.method == 'POST':
+            if site.check(request.form.get('username'),
+                          request.form.get('password')):
+                session['username'] = request.form['username']
+                site.count('logins')
+                return PAGE % ('Welcome, %s' % escape(session['username']),
+                               '<p>Welcome back!</p>')
+        return PAGE % ('Log in', LOGIN_FORM)
+
+    @app.route('/messages', methods=['GET', 'POST'])
+    def messages():
+        if session.get('username') != site.username:
+            return redirect('/login')
+        if request.args.get('readmsg'):
+            try:
+                thread_id = int(request.args['threadid'])
+            except (KeyError, ValueError):
+                abort(400)
+            if not site.has_thread(thread_id):
+                abort(404)
+            if request.method == 'POST':
+                site.reply(thread_id, request.form.get('body', u''))
+            site.count('thread_pages')
+            return site.thread_page(thread_id)
+        site.count('inbox_pages')
+        return site.inbox_page(request.args.get('low', 1, type=int))
+
+    @app.route('/stats')
+    def stats():
+        return jsonify(site.stats())
+
+    return app
+
+
+def serve(app, host='127.0.0.1', port=0):
+    """Serve an app from a background thread
+
+    Parameters
+    ----------
+    app : flask.Flask
+    host : str
+    port : int
+        0 picks a free one
+
+    Returns
+    -------
+    server : werkzeug.serving.BaseWSGIServer
+        Its `server_port` is the port it's on, and `shutdown` stops it
+    """
+    server = make_server(host, port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, name='StandIn')
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local stand-in '
+                                     'for the OkCupid site')
+    parser.add_argument('--threads', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=50,
+                        help='messages per thread')
+    parser.add_argument('--page-size', type=int, default=30,
+                        help='threads per page of the inbox')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds to wait before each response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='up to this many more seconds, at random')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests that fail with a 503')
+    parser.add_argument('--username', default='okbot')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    site = Site(args.threads, args.messages, page_size=args.page_size,
+                seed=args.seed, username=args.username)
+    app = make_app(site, latency=args.latency, jitter=args.jitter,
+                   error_rate=args.error_rate, seed=args.seed)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class Site(object):
+    """The state of the stand-in site: one account, with its threads and
+    the replies that have been sent to them. Thread-safe."""
+
+    def __init__(self, n_threads=1000, thread_len=50, page_size=30, seed=0,
+                 username='okbot', password=None):
+        """
+        Parameters
+        ----------
+        n_threads : int
+            Threads in the inbox
+        thread_len : int
+            Messages in each thread, before any replies
+        page_size : int
+            Threads per page of the inbox
+        seed : int
+            Everything on the site is generated from this
+        username : str
+        password : str, optional
+            By default any password is accepted
+        """
+        self.n_threads = n_threads
+        self.thread_len = thread_len
+        self.page_size = page_size
+        self.seed = seed
+        self.username = username
+        self.password = password
+
+        self._lock = threading.Lock()
+        # thread id -> list of (body, fancydate)
+        self._replies = {}
+        self._counts = {}
+
+    def check(self, username, password):
+        "Whether these are the account's credentials"
+        return username == self.username and (self.password is None or
+                                              password == self.password)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + n
+
+    def stats(self):
+        "How many requests, errors, pages and so on have been served"
+        with self._lock:
+            return dict(self._counts)
+
+    def thread_ids(self):
+        return range(1000000, 1000000 + self.n_threads)
+
+    def has_thread(self, thread_id):
+        return 1000000 <= thread_id < 1000000 + self.n_threads
+
+    def reply(self, thread_id, body):
+        "Add a message from the account to the end of a thread"
+        with self._lock:
+            now = time.localtime()
+            self._replies.setdefault(thread_id, []).append(
+                (body, '%s %d, %d' % (MONTHS[now.tm_mon - 1], now.tm_mday,
+                                      now.tm_year)))
+            self._counts['replies'] = self._counts.get('replies', 0) + 1
+
+    def _rng(self, thread_id):
+        return np.random.RandomState([self.seed, thread_id])
+
+    def messages(self, thread_id):
+        """The messages in a thread, oldest first
+
+        Returns
+        -------
+        messages : list of (id, sender, body, fancydate)
+        """
+        rng = self._rng(thread_id)
+        suitor = 'suitor%d' % thread_id
+        messages = []
+        for i in range(self.thread_len):
+            sender = self.username if i % 2 else suitor
+            messages.append(('%d_%d' % (thread_id, i), sender,
+                             _words(rng, 5 + rng.randint(20)),
+                             _fancydate(rng)))
+        with self._lock:
+            replies = list(self._replies.get(thread_id, []))
+        for i, (body, fancydate) in enumerate(replies, self.thread_len):
+            messages.append(('%d_%d' % (thread_id, i), self.username, body,
+                             fancydate))
+        return messages
+
+    def inbox_page(self, low=1):
+        """The messages page listing threads `low` to `low + page_size - 1`
+        (counting from 1, like the site), with a link to the next page if
+        there are more"""
+        ids = self.thread_ids()[max(low - 1, 0):low - 1 + self.page_size]
+        rows = []
+        for thread_id in ids:
+            rng = self._rng(thread_id)
+            with self._lock:
+                replies = self._replies.get(thread_id)
+                last = replies[-1] if replies else None
+            if last is None:
+                cls = 'unreadMessage' if rng.randint(2) else 'readMessage'
+                snippet, fancydate = _words(rng, 8), _fancydate(rng)
+            else:
+                cls = 'readMessage'
+                snippet, fancydate = escape(last[0]), last[1]
+            rows.append(
+                '<li class="%s"><a class="photo" href="/profile/suitor%d"></a>'
+                '<p onclick="window.location=\'/messages?readmsg=true&amp;'
+                'threadid=%d&amp;folder=1\'">suitor%d: %s</p>'
+                '<span class="fancydate">%s</span></li>'
+                % (cls, thread_id, thread_id, thread_id, snippet, fancydate))
+
+        pages = ''
+        if low - 1 + self.page_size < self.n_threads:
+            pages = ('<ul class="pages"><li class="next"><a href="/messages?'
+                     'low=%d">Next</a></li></ul>' % (low + self.page_size))
+        return PAGE % ('Messages', '<ul id="messages">%s</ul>%s' %
+                       (''.join(rows), pages))
+
+    def thread_page(self, thread_id):
+        "A thread, with the box to reply in at the end"
+        rows = []
+        for id, sender, body, fancydate in self.messages(thread_id):
+            rows.append(
+                '<li id="message_%s"><a class="photo" href="/profile/%s"></a>'
+                '<div class="message_body">%s</div>'
+                '<span class="fancydate">%s</span></li>'
+                % (id, sender, escape(body), fancydate))
+        compose = (
+            '<li id="compose"><form method="post" action="/messages?'
+            'readmsg=true&amp;threadid=%d&amp;folder=1">'
+            '<textarea id="message_text" name="body"></textarea>'
+            '<p id="send_button"><a href="#">Send</a></p></form></li>'
+            % thread_id)
+        return PAGE % ('Thread', '<ul id="thread">%s%s</ul>' %
+                       (''.join(rows), compose))
+
+
+if __name__ == '__main__':
+    main()
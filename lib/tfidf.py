@@ -0,0 +1,321 @@
+"""
+Incremental TF-IDF index for nearest-neighbor search under cosine
+similarity.
+
+Each string is tokenized into words, and its term frequencies are appended
+to a sparse term-weight matrix, kept both as (slot, term, tf) triplets and
+as per-term postings lists. The idf weights and the row norms depend on the
+whole collection, so they're recomputed lazily, in one vectorized pass,
+the first time the index is searched after strings have been added.
+
+A query then touches only the postings of its own terms: it gathers them
+and sums up the products in one `np.bincount`, which is a sparse
+matrix-vector product over the whole collection.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+from __future__ import division
+import re
+from collections import Counter
+
+import numpy as np
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['TFIDFIndex', 'tokenize']
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+##############################################################################
+# Functions
+##############################################################################
+
+
+def tokenize(text):
+    "The lowercased words in a string"
+    return TOKEN_RE.findall(text.lower())
+
+
+def _grow(array, size):
+    "`array`, with room for at least `size` entries"
+    if size <= len(array):
+        return array
+    new = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    new[:len(array)] = array
+    return new
+
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class TFIDFIndex(object):
+    """A set of strings, searchable by the cosine distance between their
+    TF-IDF vectors.
+
+    The distance from a target to a string is 1 - cos(target, text), with
+    sublinear (1 + log tf) term frequencies and smoothed idf weights.
+    Strings without any words are infinitely far from everything. This has
+    the same interface as `qgram.QGramIndex`, so it can be used as the
+    scorer of `twitter.SortedTweeterator`.
+
+    Each string is stored in a slot, numbered in insertion order. Removed
+    slots are tombstoned and the index is compacted once most of it is dead.
+    Ties in distance go to the earliest inserted string.
+    """
+
+    def __init__(self):
+        self._clear()
+
+    def _clear(self):
+        self._slots = {}           # key -> slot
+        self._keys = []            # slot -> key
+        self._alive = np.zeros(16, dtype=bool)
+        # slot -> range of its triplets
+        self._starts = np.zeros(16, dtype=np.int64)
+        self._ends = np.zeros(16, dtype=np.int64)
+
+        self._terms = {}           # word -> term id
+        self._words = []           # term id -> word
+        # term id -> number of live strings that contain it
+        self._df = np.zeros(16, dtype=np.int64)
+        # the matrix as (slot, term, weighted tf) triplets, grouped by slot
+        self._entry_slots = np.zeros(64, dtype=np.int64)
+        self._entry_terms = np.zeros(64, dtype=np.int64)
+        self._entry_tf = np.zeros(64)
+        self._n_entries = 0
+        # term id -> [slots, weighted tfs, n], with room to grow past n
+        self._postings = []
+
+        self._n_alive = 0
+        # set when strings have been added since the weights were computed
+        self._dirty = True
+        self._idf = None
+        self._norms = None
+
+    def __len__(self):
+        return self._n_alive
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def add(self, key, text, features=None):
+        """Add a string to the index. Adding a key that is already present
+        does nothing.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifies the string, e.g. the tweet id
+        text : str
+            The string itself
+        features : dict, optional
+            The precomputed 'lower'cased text, see `twitter.features`. The
+            text isn't kept, so with this it may be None
+        """
+        if key in self._slots:
+            return
+
+        if features is not None and 'lower' in features:
+            counts = Counter(TOKEN_RE.findall(features['lower']))
+        else:
+            counts = Counter(tokenize(text))
+        self._insert(key, counts.keys(),
+                     1 + np.log(np.array(counts.values(), dtype=float)))
+
+    def _insert(self, key, words, tf):
+        "Add a row of (word, weighted tf) entries under a new slot"
+        slot = len(self._keys)
+        self._alive = _grow(self._alive, slot + 1)
+        self._starts = _grow(self._starts, slot + 1)
+        self._ends = _grow(self._ends, slot + 1)
+
+        term_ids = []
+        for word in words:
+            term = self._terms.get(word)
+            if term is None:
+                term = self._terms[word] = len(self._terms)
+                self._words.append(word)
+                self._postings.append([np.zeros(4, dtype=np.int64),
+                                       np.zeros(4), 0])
+            term_ids.append(term)
+        term_ids = np.array(term_ids, dtype=np.int64)
+
+        start, end = self._n_entries, self._n_entries + len(term_ids)
+        self._entry_slots = _grow(self._entry_slots, end)
+        self._entry_terms = _grow(self._entry_terms, end)
+        self._entry_tf = _grow(self._entry_tf, end)
+        self._entry_slots[start:end] = slot
+        self._entry_terms[start:end] = term_ids
+        self._entry_tf[start:end] = tf
+        self._n_entries = end
+
+        for term, weight in zip(term_ids.tolist(), tf.tolist()):
+            entry = self._postings[term]
+            if entry[2] == len(entry[0]):
+                entry[0] = np.concatenate([entry[0], entry[0]])
+                entry[1] = np.concatenate([entry[1], entry[1]])
+            entry[0][entry[2]] = slot
+            entry[1][entry[2]] = weight
+            entry[2] += 1
+
+        self._df = _grow(self._df, len(self._terms))
+        self._df[term_ids] += 1
+
+        self._slots[key] = slot
+        self._keys.append(key)
+        self._alive[slot] = True
+        self._starts[slot], self._ends[slot] = start, end
+        self._n_alive += 1
+        self._dirty = True
+
+    def remove(self, key):
+        """Remove a string from the index
+
+        The idf weights aren't recomputed for a removal, only at the next
+        search after an `add`, so that handing out tweets one by one doesn't
+        cost a pass over the whole matrix each time.
+
+        Parameters
+        ----------
+        key : hashable
+            The key it was added with. Raises KeyError if it isn't present.
+        """
+        slot = self._slots.pop(key)
+        self._alive[slot] = False
+        self._df[self._entry_terms[self._starts[slot]:self._ends[slot]]] -= 1
+        self._n_alive -= 1
+
+        n_dead = len(self._keys) - self._n_alive
+        if n_dead > 1024 and n_dead > self._n_alive:
+            self._compact()
+
+    def _compact(self):
+        "Rebuild the index without the tombstoned slots, from their triplets"
+        live = []
+        for s in np.flatnonzero(self._alive[:len(self._keys)]):
+            start, end = self._starts[s], self._ends[s]
+            live.append((self._keys[s],
+                         [self._words[t] for t in self._entry_terms[start:end]],
+                         self._entry_tf[start:end].copy()))
+        self._clear()
+        for key, words, tf in live:
+            self._insert(key, words, tf)
+
+    def _reweight(self):
+        "Recompute the idf weights and the norm of every row"
+        n_slots = len(self._keys)
+        df = self._df[:len(self._terms)]
+        self._idf = np.log((1 + self._n_alive) / (1 + df)) + 1
+
+        n = self._n_entries
+        weights = self._entry_tf[:n] * self._idf[self._entry_terms[:n]]
+        self._norms = np.sqrt(np.bincount(self._entry_slots[:n],
+                                          weights=weights ** 2,
+                                          minlength=n_slots))
+        self._dirty = False
+
+    def nearest(self, target, k=1):
+        """Find the k strings closest to the target
+
+        Parameters
+        ----------
+        target : str
+            The string to search for
+        k : int
+            How many neighbors to return
+
+        Returns
+        -------
+        neighbors : list of (key, distance)
+            The min(k, len(self)) nearest strings, closest first
+        """
+        n_slots = len(self._keys)
+        k = min(k, self._n_alive)
+        if k <= 0:
+            return []
+        if self._dirty:
+            self._reweight()
+
+        terms, query, query_norm = self._query(target)
+
+        dots = np.zeros(n_slots)
+        if query_norm > 0:
+            postings = [self._postings[t] for t in terms]
+            slots = np.concatenate([p[0][:p[2]] for p in postings])
+            weights = np.concatenate([p[1][:p[2]] * (w * self._idf[t])
+                                      for p, w, t in zip(postings, query,
+                                                         terms)])
+            dots = np.bincount(slots, weights=weights, minlength=n_slots)
+            dots /= query_norm
+
+        norms = self._norms[:n_slots]
+        usable = self._alive[:n_slots] & (norms > 0)
+        distances = np.empty(n_slots)
+        distances.fill(np.inf)
+        distances[usable] = 1 - dots[usable] / norms[usable]
+
+        # strings with no words are still neighbors if there is nothing else
+        # left, so take the k best live slots with ties to the earliest
+        live = np.flatnonzero(self._alive[:n_slots])
+        if k < len(live):
+            kth = np.partition(distances[live], k - 1)[k - 1]
+            live = live[distances[live] <= kth]
+        order = live[np.lexsort((live, distances[live]))][:k]
+        return [(self._keys[s], distances[s]) for s in order]
+
+    def distances(self, target, keys):
+        """The distances from the target to some of the strings
+
+        Parameters
+        ----------
+        target : str
+        keys : list of hashable
+            Keys of strings in the index. Raises KeyError for any that isn't.
+
+        Returns
+        -------
+        distances : np.ndarray
+            In the same order as the keys
+        """
+        slots = np.array([self._slots[key] for key in keys], dtype=np.int64)
+        if self._dirty:
+            self._reweight()
+        terms, query, query_norm = self._query(target)
+
+        # the query as a dense vector, and the triplets of just these slots
+        dense = np.zeros(len(self._terms))
+        dense[terms] = query * self._idf[terms]
+        starts, ends = self._starts[slots], self._ends[slots]
+        lengths = ends - starts
+        entries = np.arange(np.sum(lengths)) + \
+            np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        dots = np.bincount(np.repeat(np.arange(len(slots)), lengths),
+                           weights=self._entry_tf[entries] *
+                           dense[self._entry_terms[entries]],
+                           minlength=len(slots))
+        if query_norm > 0:
+            dots /= query_norm
+
+        norms = self._norms[slots]
+        usable = norms > 0
+        distances = np.empty(len(slots))
+        distances.fill(np.inf)
+        distances[usable] = 1 - dots[usable] / norms[usable]
+        return distances
+
+    def _query(self, target):
+        """The target's terms that are in the index, their weights, and the
+        norm of the weights"""
+        counts = Counter(word for word in tokenize(target)
+                         if word in self._terms)
+        terms = [self._terms[word] for word in counts]
+        query = (1 + np.log(np.array(counts.values(), dtype=float))) * \
+            self._idf[terms]
+        return terms, query, np.sqrt(np.sum(query ** 2))
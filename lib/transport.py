@@ -0,0 +1,194 @@
+"""
+Ways for `okcupid.OkCupid` to talk to the site.
+
+A transport loads pages and exposes the current url, page source and
+title. It also knows how to fill in and submit the two forms the bot uses:
+the login form and the reply box on a thread page.
+
+  SeleniumTransport  drives a real browser. Heavy, but runs the site's
+                     javascript.
+  HTTPTransport      plain HTTP over a persistent, keep-alive
+                     requests.Session. The forms are filled in from the
+                     same DOM the xpath selectors run on.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import time
+import logging
+import urlparse
+
+import lxml.html
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['LoginError', 'SeleniumTransport', 'HTTPTransport']
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class LoginError(Exception):
+    pass
+
+
+class SeleniumTransport(object):
+    """Transport that drives a Chrome or Firefox instance with selenium"""
+
+    def __init__(self, browser='chrome'):
+        from selenium import webdriver
+        browser_switch = {'chrome': webdriver.Chrome,
+                          'firefox': webdriver.Firefox}
+        try:
+            self.driver = browser_switch[browser]()
+        except KeyError:
+            raise KeyError('Browser must be one of %s' % browser_switch.keys())
+
+    @property
+    def current_url(self):
+        return self.driver.current_url
+
+    @property
+    def page_source(self):
+        return self.driver.page_source
+
+    @property
+    def title(self):
+        return self.driver.title
+
+    def get(self, url):
+        self.driver.get(url)
+
+    def login(self, username, password):
+        "Fill in and submit the login form on the current page"
+        elem = self.driver.find_element_by_xpath('//*[@id="user"]')
+        elem.send_keys(username)
+        elem = self.driver.find_element_by_xpath('//*[@id="pass"]')
+        elem.send_keys(password)
+        elem = self.driver.find_element_by_xpath('//*[@id="login_form"]/p/a')
+        elem.click()
+
+        while not 'Welcome' in self.driver.title:
+            logging.info('Waiting on load...')
+            time.sleep(2)
+
+    def send_message(self, content, dry_run=False):
+        "Type a message into the reply box on the current page, and send it"
+        message_box = self.driver.find_element_by_xpath('//*[@id="message_text"]')
+        message_box.send_keys(content)
+
+        send_button = self.driver.find_element_by_xpath('//*[@id="send_button"]/a')
+
+        if not dry_run:
+            send_button.click()
+
+    def close(self):
+        self.driver.close()
+
+
+class HTTPTransport(object):
+    """Transport that speaks plain HTTP through a pooled requests.Session"""
+    user_agent = ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+                  '(KHTML, like Gecko) Chrome/30.0 Safari/537.36')
+
+    def __init__(self, session=None, timeout=30):
+        """
+        Parameters
+        ----------
+        session : requests.Session, optional
+            Share a session (and its connection pool and cookies)
+        timeout : float
+            Seconds to wait for each response
+        """
+        if session is None:
+            import requests
+            session = requests.Session()
+            session.headers['User-Agent'] = self.user_agent
+        self.session = session
+        self.timeout = timeout
+        self._response = None
+
+    @property
+    def current_url(self):
+        if self._response is None:
+            return None
+        return self._response.url
+
+    @property
+    def page_source(self):
+        if self._response is None:
+            return u''
+        return self._response.text
+
+    @property
+    def title(self):
+        if self._response is None:
+            return u''
+        return self._document().findtext('.//title') or u''
+
+    def get(self, url):
+        self._set_response(self.session.get(url, timeout=self.timeout))
+
+    def login(self, username, password):
+        "Fill in and submit the login form on the current page"
+        self._submit('user', {'user': username, 'pass': password})
+        if not 'Welcome' in self.title:
+            raise LoginError('Login failed, landed on "%s"' % self.title)
+
+    def send_message(self, content, dry_run=False):
+        "Fill in the reply box on the current page, and send it"
+        if not dry_run:
+            self._submit('message_text', {'message_text': content})
+
+    def close(self):
+        self.session.close()
+
+    def _set_response(self, response):
+        response.raise_for_status()
+        self._response = response
+
+    def _document(self):
+        return lxml.html.fromstring(self.page_source)
+
+    def _submit(self, field_id, values):
+        """Submit the form containing the element with id `field_id`
+
+        Parameters
+        ----------
+        field_id : str
+            The id of any element inside the form
+        values : dict
+            Maps element ids to the values to fill in. Every other field
+            keeps its default value.
+        """
+        document = self._document()
+        forms = document.xpath('//*[@id=$id]/ancestor::form', id=field_id)
+        if len(forms) == 0:
+            raise ValueError('No form containing #%s on %s' %
+                             (field_id, self.current_url))
+        form = forms[-1]
+
+        data = {}
+        for elem in form.xpath('.//input[@name] | .//textarea[@name]'):
+            if elem.get('type') in ('checkbox', 'radio') and \
+                    elem.get('checked') is None:
+                continue
+            if elem.tag == 'textarea':
+                data[elem.get('name')] = elem.text or ''
+            else:
+                data[elem.get('name')] = elem.get('value', '')
+        for elem_id, value in values.items():
+            elem = form.xpath('.//*[@id=$id]', id=elem_id)[0]
+            data[elem.get('name', elem_id)] = value
+
+        action = urlparse.urljoin(self.current_url, form.get('action') or '')
+        if form.get('method', 'get').lower() == 'post':
+            response = self.session.post(action, data=data, timeout=self.timeout)
+        else:
+            response = self.session.get(action, params=data, timeout=self.timeout)
+        self._set_response(response)
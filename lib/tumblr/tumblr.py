@@ -1,14 +1,183 @@
-from tumblpy import Tumblpy
-import yaml
-settings_fn = 'settings.yml'
+"""
+Posts from a tumblr blog, as a second source of tweets next to the twitter
+timeline (see `twitter.Tweeterator.add_source`).
 
-with open(settings_fn) as f:
-    settings = yaml.load(f)
+`TumblrSource` has the same `fetch(count, max_id=None, since_id=None)`
+method as the sources in lib/corpus.py, so its posts go through the same
+sanitizing and ranking as tweets, and can be recorded in (and warm-started
+from) a `corpus.TweetCorpus` on the `tumblr_posts` table.
+"""
 
-t = Tumblpy(app_key=settings['tumblr']['consumer_key'],
-            app_secret=settings['tumblr']['consumer_secret'],
-            oauth_token=settings['tumblr']['oauth_token'],
-            oauth_token_secret=settings['tumblr']['oauth_secret'])
+##############################################################################
+# Imports
+##############################################################################
 
-posts = t.get('posts', blog_url='okbot.tumblr.com')
-print posts
\ No newline at end of file
+import logging
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['TumblrSource', 'post_text']
+
+# the fields that make up the text of each type of post
+POST_FIELDS = {'text': ('title', 'body'),
+               'quote': ('text',),
+               'photo': ('caption',),
+               'audio': ('caption',),
+               'video': ('caption',),
+               'link': ('title', 'description'),
+               'chat': ('body',),
+               'answer': ('answer',)}
+
+##############################################################################
+# Functions
+##############################################################################
+
+
+def post_text(post):
+    """The plain text of a post from the tumblr API
+
+    Parameters
+    ----------
+    post : dict
+        One of the 'posts' in the response
+
+    Returns
+    -------
+    text : unicode
+        With the markup stripped, and empty for post types without text
+    """
+    import lxml.html
+
+    parts = []
+    for field in POST_FIELDS.get(post.get('type'), ()):
+        value = post.get(field)
+        if value and value.strip():
+            parts.append(lxml.html.fromstring(value).text_content().strip())
+    return u' '.join(part for part in parts if part)
+
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class TumblrSource(object):
+    """Posts from a tumblr blog, through the tumblr API
+
+    The API pages by offset from the newest post, not by id, so the id-based
+    paging of the twitter API is emulated on top of it: a walk backwards
+    through the blog is kept going for as long as it's asked for the posts
+    below the oldest one it has returned, and started over from the top
+    otherwise. Posts that are too long for a tweet are skipped.
+
+    Post ids are only unique within tumblr; sharing a buffer with tweets
+    relies on the two never colliding, which for 64-bit ids they
+    practically don't.
+    """
+    page_size = 20  # the most the API hands out at once
+
+    def __init__(self, blog_url, app_key, app_secret, oauth_token,
+                 oauth_token_secret, client=None, max_length=140):
+        """
+        Parameters
+        ----------
+        blog_url : str
+            E.g. 'okbot.tumblr.com'
+        app_key, app_secret, oauth_token, oauth_token_secret : str
+            The credentials, see lib/tumblr/authenticate.py
+        client : object, optional
+            Anything with the `get` method of `tumblpy.Tumblpy`, instead of
+            connecting with the credentials
+        max_length : int
+            Skip posts with more characters than this
+        """
+        if client is None:
+            from tumblpy import Tumblpy
+            client = Tumblpy(app_key=app_key, app_secret=app_secret,
+                             oauth_token=oauth_token,
+                             oauth_token_secret=oauth_token_secret)
+        self.client = client
+        self.blog_url = blog_url
+        self.max_length = max_length
+
+        # where the backwards walk through the blog has got to, and the
+        # oldest post it has returned
+        self._offset = 0
+        self._oldest = None
+
+    def fetch(self, count, max_id=None, since_id=None):
+        """Get up to `count` posts, newest first, with the same paging as
+        `twitter.TwitterSource.fetch`
+
+        Returns
+        -------
+        posts : list of dict
+            Each with the 'id' and the plain 'text'
+        """
+        if max_id is None and since_id is not None:
+            # anything new at the top, without disturbing the walk
+            offset = 0
+        else:
+            if max_id is None or self._oldest is None or \
+                    max_id >= self._oldest:
+                self._offset, self._oldest = 0, None
+            offset = self._offset
+
+        walking = max_id is not None or since_id is None
+        posts = []
+        while len(posts) < count:
+            page = self._page(offset)
+            if len(page) == 0:
+                break
+            for post in page:
+                if len(posts) >= count:
+                    break
+                offset += 1
+                if walking:
+                    self._offset = offset
+                if since_id is not None and post['id'] <= since_id:
+                    return posts
+                if max_id is not None and post['id'] > max_id:
+                    continue
+                text = post_text(post)
+                if not 0 < len(text) <= self.max_length:
+                    continue
+                posts.append({'id': post['id'], 'text': text})
+                # only the returned posts count: the next max_id is below
+                # them, not below the skipped ones
+                if walking and (self._oldest is None or
+                                post['id'] < self._oldest):
+                    self._oldest = post['id']
+        return posts
+
+    def _page(self, offset):
+        "The posts from `offset` on, newest first"
+        response = self.client.get('posts', blog_url=self.blog_url,
+                                   params={'offset': offset,
+                                           'limit': self.page_size})
+        posts = response.get('posts', [])
+        logging.debug('got %d tumblr posts at offset %d', len(posts), offset)
+        return posts
+
+
+##############################################################################
+# Tests
+##############################################################################
+
+if __name__ == '__main__':
+    import yaml
+    settings_fn = 'settings.yml'
+
+    with open(settings_fn) as f:
+        settings = yaml.load(f)['tumblr']
+
+    source = TumblrSource(settings.get('blog_url', 'okbot.tumblr.com'),
+                          app_key=settings['consumer_key'],
+                          app_secret=settings['consumer_secret'],
+                          oauth_token=settings['oauth_token'],
+                          oauth_token_secret=settings['oauth_secret'])
+
+    for post in source.fetch(20):
+        print post['id'], post['text'].encode('utf-8')
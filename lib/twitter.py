@@ -3,21 +3,45 @@
 ##############################################################################
 
 from __future__ import division
-import os
-import yaml
-import numpy as np
+import re
 import logging
+import threading
 
 import HTMLParser
-from twython import Twython  # twitter api
 from ttp import ttp  # twitter text parsing, $ pip install twitter-text-python
 
+from qgram import QGramIndex
+from tfidf import TFIDFIndex
+from buffer import TweetBuffer
+from distance import encode
+from cache import LRUCache
+from seen import SeenIds
+import metrics
+
 ##############################################################################
 # Globals
 ##############################################################################
 
 HTML_PARSER = HTMLParser.HTMLParser()
-__all__ = ['Tweeterator', 'SortedTweeterator']
+# links, hashtags and usernames, removed in this order (each pass sees what
+# the one before left, so they can't be merged into one alternation)
+SANITIZE_REGEXES = (ttp.URL_REGEX, ttp.HASHTAG_REGEX, ttp.USERNAME_REGEX)
+# something that all of those need, for a cheap check before running them
+MARKER_REGEX = re.compile(u'[#@\uff03\uff20]|://|www\\.', re.IGNORECASE)
+__all__ = ['TwitterSource', 'Feed', 'Tweeterator', 'SortedTweeterator',
+           'AccountTweeterator', 'Prefetcher']
+
+# the ways `SortedTweeterator` can rank the buffer. A scorer is an index over
+# the buffered tweets with `add(key, text, features=None)` (the features
+# being a dict like the one from `features`), `remove(key)`, `__contains__`,
+# `__len__`, `nearest(target, k)` returning [(key, distance)], closest
+# first, and `distances(target, keys)`. See lib/qgram.py and lib/tfidf.py
+SCORERS = {'levenshtein': QGramIndex, 'tfidf': TFIDFIndex}
+
+# what's left out of the ranking cache's keys
+PUNCTUATION_REGEX = re.compile(r'[\W_]+', re.UNICODE)
+# "heyyy", "hiiii", "sooo"
+REPEATS_REGEX = re.compile(r'(\w)\1{2,}', re.UNICODE)
 
 ##############################################################################
 # Functions
@@ -63,30 +87,134 @@ def sanitize(text):
         A santized version of the input, with stuff removed
     """
 
-    text = ttp.URL_REGEX.sub('', text)
-    text = ttp.HASHTAG_REGEX.sub('', text)
-    text = ttp.USERNAME_REGEX.sub('', text)
-    text = HTML_PARSER.unescape(text)
+    if MARKER_REGEX.search(text) is not None:
+        for regex in SANITIZE_REGEXES:
+            text = regex.sub('', text)
+    if '&' in text:
+        text = HTML_PARSER.unescape(text)
     return text
 
 
+def normalize(text):
+    """Fold a message down to what matters for picking a reply to it, so
+    that near-identical openers ("hey", "Hey!!", "heyyy :)") share a cached
+    ranking: lowercased, with the punctuation and whitespace squeezed down
+    to single spaces, and letters repeated three or more times cut back to
+    one. Text with no letters or digits at all is only lowercased and
+    stripped.
+    """
+    lower = text.lower()
+    folded = PUNCTUATION_REGEX.sub(' ', REPEATS_REGEX.sub(r'\1', lower))
+    return folded.strip() or lower.strip()
+
+
+def features(tweet_id, text):
+    """A sanitized tweet, with everything the scorers need precomputed,
+    so that ranking never has to derive it again. These only live until the
+    tweet is in the buffer and the scorer's index
+
+    Returns
+    -------
+    tweet : dict
+        The 'id' and 'text', the 'lower'cased text, its 'length', and the
+        'codes' of the lowercased text for the distance kernel
+    """
+    lower = text.lower()
+    return {'id': tweet_id, 'text': text, 'lower': lower,
+            'length': len(text), 'codes': encode(lower)}
+
+
 ##############################################################################
 # Classes
 ##############################################################################
 
 
+class TwitterSource(object):
+    """Tweets from your home timeline, through the twitter API"""
+
+    def __init__(self, app_key, app_secret, oauth_token, oauth_token_secret):
+        from twython import Twython  # twitter api
+        self.t = Twython(app_key=app_key, app_secret=app_secret,
+                         oauth_token=oauth_token,
+                         oauth_token_secret=oauth_token_secret)
+
+    def fetch(self, count, max_id=None, since_id=None):
+        """Get a page of the home timeline
+
+        Parameters
+        ----------
+        count : int
+            How many tweets to ask for
+        max_id : int, optional
+            Only get tweets with ids less than or equal to this
+        since_id : int, optional
+            Only get tweets with ids greater than this
+
+        Returns
+        -------
+        tweets : list of dict
+            The raw tweets, newest first. Each has at least an 'id' and 'text'
+        """
+        kwargs = {}
+        if since_id is not None:
+            kwargs['since_id'] = since_id
+        return self.t.getHomeTimeline(count=count, include_rts=False,
+                                      max_id=max_id, **kwargs)
+
+
+class Feed(object):
+    """One of the sources a `Tweeterator` pulls from, with the state for
+    paging through it: the ids it has handed out, and the range of ids
+    fetched from it so far"""
+
+    def __init__(self, name, source, seen_ids, corpus=None):
+        """
+        Parameters
+        ----------
+        name : str or None
+            For the logs. The Tweeterator's own source has no name
+        source : object
+            Anything with a `fetch` method, see lib/corpus.py
+        seen_ids : seen.SeenIds
+        corpus : corpus.TweetCorpus, optional
+            If given, everything that's pulled is recorded here
+        """
+        self.name = name
+        self.source = source
+        self.seen_ids = seen_ids
+        self.corpus = corpus
+        self.oldest_fetched = None
+        self.newest_fetched = None
+
+    def __repr__(self):
+        return '<Feed %s>' % (self.name or 'main')
+
+
 class Tweeterator(object):
     """Iterator over the entries in a user's twitter home timeline.
 
-    This uses the Twython interface to the twitter API to get the most recent
-    tweets from your home screen and feed them out as an iterator.
+    By default this uses the Twython interface to the twitter API to get the
+    most recent tweets from your home screen and feed them out as an
+    iterator. Any other object with the same `fetch` method as
+    `TwitterSource` can be used instead, e.g. the local corpus or a fixture
+    file from lib/corpus.py.
 
     Additionally, we use some simple disk-based persistence to store the tweet
-    ids in a file. This way, when you rerun this code, you won't keep getting
-    the same tweets from the top of your feed.
+    ids (see `seen.SeenIds`). This way, when you rerun this code, you won't
+    keep getting the same tweets from the top of your feed.
+
+    More sources (e.g. a `tumblr.TumblrSource`) can be merged into the same
+    buffer with `add_source`. Each is paged through on its own, and keeps
+    its own store of seen ids next to the main one. Ids have to be unique
+    across the sources.
+
+    The buffered tweets are kept in a `buffer.TweetBuffer`, oldest first.
+    It can be kept topped up from background threads, one per source, with
+    `start_prefetch`. All access to the buffer goes through `_lock`.
     """
-    def __init__(self, app_key, app_secret, oauth_token, oauth_token_secret,
-                 tweet_id_fn):
+    def __init__(self, app_key=None, app_secret=None, oauth_token=None,
+                 oauth_token_secret=None, tweet_id_fn=None, source=None,
+                 corpus=None):
         """Create the object
 
         Parameters
@@ -95,23 +223,74 @@ class Tweeterator(object):
         app_secret : str
         oauth_token : str
         oauth_token_secret : str
-            You need to get these to connect to the twitter API
+            You need to get these to connect to the twitter API, unless you
+            give a `source`
         tweed_id_fn : str
-            Filename for the flat text file that's going to hold the ids of
-            the tweets that have been dispensed.
+            Base filename for the store that's going to hold the ids of the
+            tweets that have been dispensed. An old-style flat text file at
+            this path is migrated automatically.
+        source : object, optional
+            Where to get tweets from instead of the twitter API, e.g. a
+            `corpus.TweetCorpus` or `corpus.JSONLSource`
+        corpus : corpus.TweetCorpus, optional
+            If given, every tweet that's pulled is recorded here
         """
-
-        self.t = Twython(app_key=app_key, app_secret=app_secret,
-                         oauth_token=oauth_token,
-                         oauth_token_secret=oauth_token_secret)
+        if tweet_id_fn is None:
+            raise ValueError('tweet_id_fn is required')
+        if source is None:
+            source = TwitterSource(app_key, app_secret, oauth_token,
+                                   oauth_token_secret)
+        self.source = source
+        self.corpus = corpus
 
         self.tweet_id_fn = tweet_id_fn
-        self.seen_ids = []
-        self.buffer = []
+        self.seen_ids = SeenIds(self.tweet_id_fn)
+        self.buffer = TweetBuffer()
+        self.feeds = [Feed(None, source, self.seen_ids, corpus)]
+        self.prefetchers = []
+
+        self._lock = threading.RLock()
+        # notified whenever the buffer changes
+        self._changed = threading.Condition(self._lock)
+        # buffered tweet id -> its feed, for the ones not from the main feed
+        self._origins = {}
+        # (low, high, page_size) while prefetching
+        self._watermarks = None
+        # room in the buffer claimed by prefetchers for the pages they're
+        # fetching, see `Prefetcher._reserve`
+        self._reserved = 0
+
+    @property
+    def prefetcher(self):
+        "The first of the `prefetchers`, or None when not prefetching"
+        return self.prefetchers[0] if self.prefetchers else None
+
+    def add_source(self, name, source, corpus=None):
+        """Pull from another source too, into the same buffer. If the buffer
+        is being prefetched, this source gets a prefetcher of its own.
 
-        if os.path.exists(self.tweet_id_fn):
-            self.seen_ids = np.loadtxt(self.tweet_id_fn, dtype=int, ndmin=1).tolist()
+        Parameters
+        ----------
+        name : str
+            Names its store of seen ids, at `tweet_id_fn`-<name>
+        source : object
+            Anything with a `fetch` method, see lib/corpus.py
+        corpus : corpus.TweetCorpus, optional
+            If given, everything pulled from the source is recorded here
 
+        Returns
+        -------
+        feed : Feed
+        """
+        feed = Feed(name, source, SeenIds('%s-%s' % (self.tweet_id_fn, name)),
+                    corpus)
+        with self._lock:
+            self.feeds.append(feed)
+            if self._watermarks is not None:
+                self._start_prefetcher(feed)
+        return feed
+
+    @metrics.timed('pull')
     def pull(self, count=20):
         """Fetch some tweets
 
@@ -123,21 +302,163 @@ class Tweeterator(object):
         Parameters
         ----------
         count : int
-            How many to fetch
+            How many to fetch, split between the sources
         """
+        feeds = list(self.feeds)
+        if len(feeds) == 1:
+            self._extend(self._fetch(count))
+            return
+
+        share = -(-count // len(feeds))
+        failed = 0
+        for feed in feeds:
+            try:
+                self._extend(self._fetch(share, feed), feed)
+            except Exception:
+                logging.exception('Pulling from %r failed', feed)
+                failed += 1
+        if failed == len(feeds):
+            raise RuntimeError('Nothing could be pulled from any source')
+
+    def warm_start(self, source, count, feed=None):
+        """Fill the buffer from a local source, like the corpus, before going
+        to the API. Tweets that have already been seen are skipped.
 
-        min_id = None
-        if len(self.seen_ids) > 0:
-            min_id = min(self.seen_ids) - 1
+        Parameters
+        ----------
+        source : object
+            Anything with a `fetch` method, see lib/corpus.py
+        count : int
+            How many tweets to try to get into the buffer
+        feed : Feed, optional
+            The feed the source caches, by default the main one
+        """
+        max_id = None
+        while len(self.buffer) < count:
+            buf = source.fetch(count, max_id=max_id)
+            if len(buf) == 0:
+                break
+            self._extend(self._prepare(buf), feed)
+            max_id = min(b['id'] for b in buf) - 1
+        logging.info('warm started with %d tweets', len(self.buffer))
+
+    def _fetch(self, count, feed=None):
+        """Get a page of tweets from one of the sources
+
+        We page backwards through the timeline, starting below the oldest
+        tweet that's been seen or fetched. When that runs dry, we go back to
+        the top of the timeline and get anything newer than what we've had.
+
+        Parameters
+        ----------
+        count : int
+        feed : Feed, optional
+            By default the main one
 
-        buf = self.t.getHomeTimeline(count=count, include_rts=False, max_id=min_id)
+        Returns
+        -------
+        tweets : list of dict
+            The sanitized tweets, each with an 'id' and 'text'
+        """
+        if feed is None:
+            feed = self.feeds[0]
+        with self._lock:
+            known = [i for i in (feed.seen_ids.min(), feed.oldest_fetched)
+                     if i is not None]
+            max_id = min(known) - 1 if len(known) > 0 else None
+            known = [i for i in (feed.seen_ids.max(), feed.newest_fetched)
+                     if i is not None]
+            since_id = max(known) if len(known) > 0 else None
+
+        buf = feed.source.fetch(count, max_id=max_id)
+        if len(buf) == 0 and since_id is not None:
+            buf = feed.source.fetch(count, since_id=since_id)
         if len(buf) == 0:
-            raise RuntimeError('Zero tweets sucessfully pulled from twitter API. :(')
-        
-        # add new tweets to old buffer
-        self.buffer.extend([{'id': b['id'], 'text': sanitize(b['text'])} for b in buf])
+            raise RuntimeError('Zero tweets sucessfully pulled from %r. :(' %
+                               feed)
+
+        with self._lock:
+            ids = [b['id'] for b in buf]
+            if feed.oldest_fetched is None or min(ids) < feed.oldest_fetched:
+                feed.oldest_fetched = min(ids)
+            if feed.newest_fetched is None or max(ids) > feed.newest_fetched:
+                feed.newest_fetched = max(ids)
+
+        logging.info('pulled %d tweets from %r', len(buf), feed)
+        tweets = self._prepare(buf)
+        if feed.corpus is not None and feed.corpus is not feed.source:
+            feed.corpus.add(buf)
+        return tweets
+
+    def _prepare(self, buf):
+        """Turn a page of tweets from a source into buffer entries, in one
+        pass: sanitize each (unless the source already has) and compute its
+        `features`"""
+        tweets = []
+        for b in buf:
+            if 'sanitized' not in b:
+                b['sanitized'] = sanitize(b['text'])
+            tweets.append(features(b['id'], b['sanitized']))
+        return tweets
+
+    def _extend(self, tweets, feed=None):
+        """Add tweets from one of the feeds (by default the main one) to
+        the buffer, skipping any that have already been seen or are already
+        buffered
 
-        logging.info('pulled %d tweets', count)
+        Returns
+        -------
+        added : list of dict
+            The tweets that were actually added, with their `features`
+        """
+        if feed is None:
+            feed = self.feeds[0]
+        with self._lock:
+            added = []
+            for tweet in tweets:
+                if tweet['id'] in self.buffer or tweet['id'] in feed.seen_ids:
+                    continue
+                self.buffer.append(tweet['id'], tweet['text'])
+                if feed is not self.feeds[0]:
+                    self._origins[tweet['id']] = feed
+                added.append(tweet)
+
+            self._changed.notify_all()
+            return added
+
+    def start_prefetch(self, low=50, high=200, page_size=100):
+        """Keep the buffer topped up from background threads, one per
+        source, so that the sources are fetched from concurrently
+
+        Parameters
+        ----------
+        low : int
+            Refill the buffer when it drops below this many tweets
+        high : int
+            Stop refilling once it has this many
+        page_size : int
+            Maximum number of tweets to ask a source for at once
+        """
+        with self._lock:
+            if self._watermarks is not None:
+                raise RuntimeError('Already prefetching')
+            self._watermarks = (low, high, page_size)
+            for feed in self.feeds:
+                self._start_prefetcher(feed)
+
+    def _start_prefetcher(self, feed):
+        low, high, page_size = self._watermarks
+        prefetcher = Prefetcher(self, low, high, page_size, feed)
+        self.prefetchers.append(prefetcher)
+        prefetcher.start()
+
+    def stop_prefetch(self):
+        "Stop the background threads started by `start_prefetch`"
+        with self._lock:
+            prefetchers, self.prefetchers = self.prefetchers, []
+            self._watermarks = None
+        for prefetcher in prefetchers:
+            prefetcher.stop()
 
     def __iter__(self):
         """Part of the iterator API"""
@@ -151,40 +472,343 @@ class Tweeterator(object):
         text : str
             The text of the tweet, after being sanitized
         """
-        if len(self.buffer) <= 0:
-            self.pull()
+        with self._lock:
+            if len(self.buffer) <= 0:
+                self.pull()
 
-        tweet = self.buffer.pop(0)
-        self.seen_ids.append(tweet['id'])
-        with open(self.tweet_id_fn, 'a') as f:
-            print >> f, tweet['id']
-        return tweet['text']
+            return self._consume()
+
+    def _consume(self, tweet_id=None):
+        """Remove a tweet from the buffer and mark it as seen
+
+        Parameters
+        ----------
+        tweet_id : int, optional
+            Which tweet. Defaults to the oldest one in the buffer
+
+        Returns
+        -------
+        text : str
+            The text of the tweet
+        """
+        with self._lock:
+            tweet_id, text = self.buffer.pop(tweet_id)
+            feed = self._origins.pop(tweet_id, self.feeds[0])
+            feed.seen_ids.add(tweet_id)
+            self._changed.notify_all()
+            return text
 
 
 class SortedTweeterator(Tweeterator):
+    """Tweeterator that, given a target message, hands out the buffered tweet
+    that the scorer ranks closest to it. By default that's the smallest
+    Levenshtein distance (normalized by the length of the tweet); the
+    'tfidf' scorer uses the cosine similarity of word TF-IDF vectors instead,
+    which is much cheaper on big buffers.
+
+    The buffer is mirrored in the scorer's index (e.g. a `QGramIndex`),
+    which is updated as tweets are pulled and consumed, so a query doesn't
+    have to start from scratch.
+
+    Each query keeps the `cursor_len` best candidates it found in the
+    `rankings` LRU cache, keyed by the `normalize`d target, so that the common
+    openers are answered without ranking the buffer again. Asking again for
+    the same target (e.g. after the console operator vetoes a response) just
+    takes the next-best candidate that hasn't been consumed yet. Newly
+    pulled tweets are merged into the cached cursors where they rank high
+    enough, and cursors expire after `rankings_ttl` seconds.
+    """
     ideal_buffer_len = 100
-    large_number = 1e10
-    
+    cursor_len = 10
+    rankings_size = 128
+    rankings_ttl = 3600  # seconds
+
+    def __init__(self, *args, **kwargs):
+        """Takes the same arguments as `Tweeterator`, plus
+
+        Parameters
+        ----------
+        scorer : str or object, optional
+            One of the names in `SCORERS` (default 'levenshtein'), or an empty
+            scorer instance
+        """
+        scorer = kwargs.pop('scorer', 'levenshtein')
+        super(SortedTweeterator, self).__init__(*args, **kwargs)
+        if isinstance(scorer, basestring):
+            try:
+                scorer = SCORERS[scorer]()
+            except KeyError:
+                raise KeyError('Scorer must be one of %s' % SCORERS.keys())
+        self.index = scorer
+        # normalized target -> (target, [(distance, tweet id), ...])
+        self.rankings = LRUCache(maxsize=self.rankings_size,
+                                 ttl=self.rankings_ttl)
+        # seen ids of the `AccountTweeterator`s that keep their own
+        self._sharers = []
+
+    def _extend(self, tweets, feed=None):
+        with self._lock:
+            added = super(SortedTweeterator, self)._extend(tweets, feed)
+            for tweet in added:
+                self.index.add(tweet['id'], tweet['text'], tweet)
+            if len(added) > 0:
+                self._merge_rankings([tweet['id'] for tweet in added])
+            return added
+
+    def _merge_rankings(self, tweet_ids):
+        """Fold new tweets into the cached rankings. A new tweet can only go
+        in as far down as the worst tweet already there, since beyond that
+        some old tweet that didn't make the cut might beat it.
+
+        TF-IDF distances drift a little as the idf weights change, so the
+        cached tweets are scored again too; the drift in the rest of the
+        buffer is left to `rankings_ttl`.
+        """
+        for key, (target, ranking) in self.rankings.items():
+            old = [tweet_id for distance, tweet_id in ranking
+                   if tweet_id in self.index]
+            if len(old) == 0:
+                self.rankings.discard(key)
+                continue
+            distances = self.index.distances(target, old + tweet_ids).tolist()
+            old = zip(distances[:len(old)], old)
+            worst = max(distance for distance, tweet_id in old)
+            new = [(distance, tweet_id) for distance, tweet_id
+                   in zip(distances[len(old):], tweet_ids)
+                   if distance <= worst]
+            # a stable sort, so ties still go to the older tweets
+            merged = sorted(old + new, key=lambda entry: entry[0])
+            ranking[:] = merged[:self.cursor_len]
+
+    @metrics.timed('rank')
     def next(self, target=None):
         if target is None:
             return super(SortedTweeterator, self).next()
-        
-        if len(self.buffer) <= self.ideal_buffer_len / 2:
+
+        with self._lock:
+            self._top_up()
+
+            key = normalize(target)
+            entry = self.rankings.get(key, valid=self._prune_ranking)
+            if entry is None:
+                ranking = [(distance, tweet_id) for tweet_id, distance
+                           in self.index.nearest(target, k=self.cursor_len)]
+                metrics.count('rankings_computed')
+                entry = (target, ranking)
+                self.rankings.put(key, entry)
+
+            distance, tweet_id = entry[1].pop(0)
+            metrics.count('tweets_ranked')
+            return self._consume(tweet_id)
+
+    @metrics.timed('rank')
+    def _next_unseen(self, seen_ids, target=None):
+        """The closest buffered tweet to the target that isn't in
+        `seen_ids`, for an `AccountTweeterator`. It's added to `seen_ids`,
+        and only consumed once every sharer has had it.
+
+        These don't go through the `rankings` cache, since the cursors in it
+        are shared by everyone asking for the same target.
+        """
+        with self._lock:
+            self._top_up()
+            k = self.cursor_len
+            while True:
+                if target is None:
+                    candidates = self.buffer.ids().tolist()
+                else:
+                    candidates = [tweet_id for tweet_id, distance
+                                  in self.index.nearest(target, k=k)]
+                for tweet_id in candidates:
+                    if tweet_id in seen_ids:
+                        # left behind by a sharer that's gone, or from
+                        # before a restart
+                        if all(tweet_id in s for s in self._sharers):
+                            self._consume(tweet_id)
+                        continue
+                    seen_ids.add(tweet_id)
+                    metrics.count('tweets_ranked')
+                    if all(tweet_id in s for s in self._sharers):
+                        return self._consume(tweet_id)
+                    return self.buffer.text(tweet_id)
+
+                if target is not None and k < len(self.index):
+                    k *= 4
+                else:
+                    # this account has had everything in the buffer
+                    self.pull(self.ideal_buffer_len)
+                    k = self.cursor_len
+
+    def _top_up(self):
+        # with a prefetcher running, only go to the network ourselves if
+        # there's nothing at all to hand out
+        if self.prefetcher is None:
+            if len(self.buffer) <= self.ideal_buffer_len / 2:
+                self.pull(self.ideal_buffer_len)
+        elif len(self.buffer) == 0:
             self.pull(self.ideal_buffer_len)
-        
-        lower_target = target.lower()
-        def normalized_distance(tweet):
-            text = tweet['text']
-            if len(text) == 0:
-                return self.large_number
-            dist = levenshtein(text.lower(), lower_target) / len(text)
-            return dist
-        
-        # sort by distance to target
-        self.buffer.sort(key=normalized_distance)
-        # print [b['text'] for b in self.buffer]
-        return super(SortedTweeterator, self).next()
-            
+
+    def _consume(self, tweet_id=None):
+        with self._lock:
+            if tweet_id is None:
+                tweet_id = self.buffer.oldest()
+            self.index.remove(tweet_id)
+            return super(SortedTweeterator, self)._consume(tweet_id)
+
+    def _prune_ranking(self, entry):
+        """Drop the already-consumed tweets from the front of a cached
+        ranking, and report whether there's anything left in it"""
+        target, ranking = entry
+        while len(ranking) > 0 and ranking[0][1] not in self.index:
+            ranking.pop(0)
+        return len(ranking) > 0
+
+
+class AccountTweeterator(object):
+    """One account's share of a `SortedTweeterator` that several accounts
+    draw from, so that they all use the one buffer and index.
+
+    Without `seen_ids`, the accounts just take turns consuming the shared
+    buffer, and no two of them ever get the same tweet. With `seen_ids`,
+    each account keeps its own record of the tweets it has had, and gets the
+    closest one it hasn't had yet. A tweet then only leaves the shared buffer
+    once every account that keeps its own record has had it.
+
+    Has the parts of the `SortedTweeterator` interface that
+    `app.respond_to_messages` uses.
+    """
+
+    def __init__(self, shared, seen_ids=None):
+        """
+        Parameters
+        ----------
+        shared : SortedTweeterator
+        seen_ids : seen.SeenIds, optional
+            The ids of the tweets this account has had, if they're not
+            exclusive to it
+        """
+        self.shared = shared
+        self.seen_ids = seen_ids
+        if seen_ids is not None:
+            with shared._lock:
+                shared._sharers.append(seen_ids)
+
+    @property
+    def prefetcher(self):
+        return self.shared.prefetcher
+
+    @property
+    def rankings(self):
+        return self.shared.rankings
+
+    def pull(self, count=20):
+        self.shared.pull(count)
+
+    def __iter__(self):
+        return self
+
+    def next(self, target=None):
+        if self.seen_ids is None:
+            return self.shared.next(target=target)
+        return self.shared._next_unseen(self.seen_ids, target=target)
+
+
+class Prefetcher(threading.Thread):
+    """Background thread that keeps a Tweeterator's buffer between two
+    watermarks, by fetching from one of its feeds.
+
+    Once the buffer drops below `low` tweets, pages are fetched until it
+    holds at least `high`. Then the thread sleeps until tweets are consumed.
+    Errors from the API are logged and retried with exponential backoff.
+    With several feeds, each has a prefetcher of its own, and they fill the
+    buffer concurrently. Each claims the room for a page before fetching
+    it, so that together they don't overshoot `high`.
+    """
+    min_backoff = 15   # seconds
+    max_backoff = 900  # seconds
+
+    def __init__(self, tweeterator, low, high, page_size, feed=None):
+        if feed is None:
+            feed = tweeterator.feeds[0]
+        name = 'Prefetcher'
+        if feed.name is not None:
+            name += '-' + feed.name
+        super(Prefetcher, self).__init__(name=name)
+        self.daemon = True
+        self.tweeterator = tweeterator
+        self.feed = feed
+        self.low = low
+        self.high = high
+        self.page_size = page_size
+        self._stopped = threading.Event()
+
+    def run(self):
+        tweeterator = self.tweeterator
+        backoff = self.min_backoff
+
+        # from dropping below `low` until getting back up to `high`
+        filling = False
+
+        while not self._stopped.is_set():
+            with tweeterator._changed:
+                count = 0
+                while not self._stopped.is_set():
+                    if len(tweeterator.buffer) < self.low:
+                        filling = True
+                    elif len(tweeterator.buffer) >= self.high:
+                        filling = False
+                    if filling:
+                        count = self._reserve()
+                        if count > 0:
+                            break
+                    tweeterator._changed.wait()
+            if count == 0:
+                break
+
+            try:
+                tweeterator._extend(tweeterator._fetch(count, self.feed),
+                                    self.feed)
+            except Exception:
+                # give the room back while backing off, for the others
+                self._release(count)
+                logging.exception('Prefetching from %r failed, retrying '
+                                  'in %d seconds', self.feed, backoff)
+                self._stopped.wait(backoff)
+                backoff = min(2 * backoff, self.max_backoff)
+            else:
+                self._release(count)
+                backoff = self.min_backoff
+
+    def _reserve(self):
+        """Claim room in the buffer for the next page, up to `high` counting
+        what the other prefetchers have claimed
+
+        Returns
+        -------
+        count : int
+            How many tweets to fetch, 0 if there's no room left
+        """
+        tweeterator = self.tweeterator
+        with tweeterator._lock:
+            count = max(min(self.high - len(tweeterator.buffer) -
+                            tweeterator._reserved, self.page_size), 0)
+            tweeterator._reserved += count
+            return count
+
+    def _release(self, count):
+        "Give back room claimed by `_reserve`, once the page is in"
+        tweeterator = self.tweeterator
+        with tweeterator._changed:
+            tweeterator._reserved -= count
+            tweeterator._changed.notify_all()
+
+    def stop(self):
+        "Ask the thread to exit, and wait for it"
+        with self.tweeterator._changed:
+            self._stopped.set()
+            self.tweeterator._changed.notify_all()
+        self.join()
+
 
 ##############################################################################
 # Tests
@@ -192,6 +816,7 @@ class SortedTweeterator(Tweeterator):
 
 
 if __name__ == '__main__':
+    import yaml
     with open('settings.yml') as f:
         settings = yaml.load(f)
 
@@ -0,0 +1,250 @@
+"""
+Giving the console operator a chance to veto replies without holding
+everything else up.
+
+Every proposed reply is printed with a number, and is sent once its own
+veto window has passed. Typing the number (and enter) vetoes it; a bare
+enter vetoes the newest one. A vetoed reply is replaced by a fresh draw,
+which gets a window of its own.
+
+The windows all run at the same time, and the sending (and drawing the
+replacements for vetoed replies) happens on threads of their own, so the
+caller can keep on scraping and ranking while replies are waiting or going
+out. Several accounts can share the one console, each proposing through a
+`Sender` of its own.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import os
+import sys
+import time
+import Queue
+import logging
+import itertools
+import threading
+from select import select
+
+##############################################################################
+# Globals
+##############################################################################
+
+__all__ = ['VetoQueue', 'Sender']
+
+##############################################################################
+# Classes
+##############################################################################
+
+
+class VetoQueue(object):
+    """Replies waiting out their veto windows before they're sent"""
+
+    def __init__(self, send, timeout=2, stdin=sys.stdin, stdout=sys.stdout):
+        """
+        Parameters
+        ----------
+        send : callable
+            `send(thread_id, response)` sends a reply. It's only ever called
+            from the sending thread, so it shouldn't share a browser with
+            anything else (see `OkCupid.spawn`). Can be None if every
+            proposal brings its own.
+        timeout : float
+            Length of each veto window, in seconds
+        stdin, stdout : file
+            Where the operator types, and where the proposals are shown
+        """
+        self.send = send
+        self.timeout = timeout
+        self.stdin = stdin
+        self.stdout = stdout
+
+        self._changed = threading.Condition()
+        # number -> (deadline, thread_id, response, draw, send, owner)
+        self._pending = {}
+        # owner -> replies proposed but not yet sent (or failed), counting
+        # the ones waiting on a replacement for a veto
+        self._outstanding = {}
+        self._numbers = itertools.count(1)
+        self._outbox = Queue.Queue()
+        self._redraws = Queue.Queue()
+        self._typed = ''
+
+        for target in (self._watch, self._send_loop, self._redraw_loop):
+            worker = threading.Thread(target=target)
+            worker.daemon = True
+            worker.start()
+
+    def __len__(self):
+        with self._changed:
+            return len(self._pending)
+
+    def propose(self, thread_id, draw, send=None, owner=None):
+        """Show a reply and queue it up to be sent once its window is over
+
+        Parameters
+        ----------
+        thread_id : str
+        draw : callable
+            Returns a candidate reply. Called again for a replacement
+            whenever the operator vetoes one.
+        send : callable, optional
+            Sends this reply instead of the queue's own `send`
+        owner : hashable, optional
+            Who it's for, so that `join` can wait on just their replies
+        """
+        with self._changed:
+            self._outstanding[owner] = self._outstanding.get(owner, 0) + 1
+        try:
+            self._queue_up(thread_id, draw, send or self.send, owner)
+        except Exception:
+            self._done(owner)
+            raise
+
+    def join(self, owner=None):
+        """Block until every proposed reply has been sent (or failed), or
+        with `owner`, every reply proposed with that owner"""
+        with self._changed:
+            while self._n_outstanding(owner) > 0:
+                self._changed.wait()
+
+    def _n_outstanding(self, owner=None):
+        if owner is None:
+            return sum(self._outstanding.values())
+        return self._outstanding.get(owner, 0)
+
+    def _done(self, owner):
+        "One of `owner`'s replies is finished with"
+        with self._changed:
+            self._outstanding[owner] -= 1
+            if self._outstanding[owner] == 0:
+                del self._outstanding[owner]
+            self._changed.notify_all()
+
+    def _queue_up(self, thread_id, draw, send, owner):
+        "Draw a reply, show it and start its window"
+        number = next(self._numbers)
+        while True:
+            response = draw()
+            try:
+                print >>self.stdout, '[%d] RESPONDING TO %s WITH: "%s"' % (
+                    number, thread_id, response)
+            except UnicodeEncodeError:
+                print >>self.stdout, 'Unicode error. Getting new tweet'
+                continue
+            break
+        self.stdout.flush()
+
+        with self._changed:
+            self._pending[number] = (time.time() + self.timeout, thread_id,
+                                     response, draw, send, owner)
+            self._changed.notify_all()
+
+    def _veto(self, line):
+        with self._changed:
+            if len(self._pending) == 0:
+                return
+            if line == '':
+                number = max(self._pending)
+            else:
+                try:
+                    number = int(line)
+                except ValueError:
+                    print >>self.stdout, 'Type a reply number to veto it'
+                    return
+            if number not in self._pending:
+                return
+            deadline, thread_id, response, draw, send, owner = \
+                self._pending.pop(number)
+
+        print >>self.stdout, '[%d] VETOED' % number
+        # it stays outstanding until the replacement has been sent. Drawing
+        # that can go to the network, so it's left to another thread
+        self._redraws.put((thread_id, draw, send, owner))
+
+    def _watch(self):
+        "Hand replies over to the sender as their windows close, and read vetoes"
+        while True:
+            with self._changed:
+                while len(self._pending) == 0:
+                    self._changed.wait()
+                now = time.time()
+                for number in sorted(self._pending):
+                    deadline, thread_id, response, draw, send, owner = \
+                        self._pending[number]
+                    if deadline <= now:
+                        del self._pending[number]
+                        self._outbox.put((send, thread_id, response,
+                                          owner))
+                self._changed.notify_all()
+                if len(self._pending) == 0:
+                    continue
+                wait = min(p[0] for p in self._pending.values()) - now
+
+            if self.stdin is None:
+                time.sleep(wait)
+                continue
+            rlist, _, _ = select([self.stdin], [], [], wait)
+            if len(rlist) > 0:
+                for line in self._read_lines():
+                    self._veto(line.strip())
+
+    def _read_lines(self):
+        """The complete lines typed since the last call. This reads the file
+        descriptor directly, since anything sitting in the file object's own
+        buffer would be invisible to select"""
+        data = os.read(self.stdin.fileno(), 4096)
+        if data == '':
+            # end of input, nobody's there to veto anything
+            self.stdin = None
+            return []
+        lines = (self._typed + data).split('\n')
+        self._typed = lines.pop()
+        return lines
+
+    def _send_loop(self):
+        while True:
+            send, thread_id, response, owner = self._outbox.get()
+            try:
+                send(thread_id, response)
+            except Exception:
+                logging.exception('Sending the reply to thread %s failed',
+                                  thread_id)
+            finally:
+                self._done(owner)
+
+    def _redraw_loop(self):
+        "Draw the replacements for vetoed replies"
+        while True:
+            thread_id, draw, send, owner = self._redraws.get()
+            try:
+                self._queue_up(thread_id, draw, send, owner)
+            except Exception:
+                logging.exception('Drawing a replacement reply to thread %s '
+                                  'failed', thread_id)
+                self._done(owner)
+
+
+class Sender(object):
+    """One account's way into a `VetoQueue` shared by several, with the
+    same `propose` and `join` as the queue itself"""
+
+    def __init__(self, queue, send):
+        """
+        Parameters
+        ----------
+        queue : VetoQueue
+        send : callable
+            Sends this account's replies, see `VetoQueue`
+        """
+        self.queue = queue
+        self.send = send
+
+    def propose(self, thread_id, draw):
+        self.queue.propose(thread_id, draw, send=self.send, owner=self)
+
+    def join(self):
+        """Block until every reply proposed through this sender has been
+        sent (or failed). Other accounts' replies don't hold it up"""
+        self.queue.join(owner=self)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+"""
+Load test of the bot against the local stand-in for the site (see
+lib/standin.py): a full scan of the inbox, end to end.
+
+The bot logs in over HTTP and pages through the whole inbox. Then it
+scrapes every thread with a pool of workers and ingests the messages into a
+temporary database, through `app.log_threads`. It replies to some of
+the threads and scans again, picking up only the threads whose rows
+changed. Each phase's throughput is reported, along with the request
+latency the bot saw and the errors it had to retry:
+
+    python loadtest.py --threads 10000 --messages 500 --workers 8
+    python loadtest.py --latency 0.05 --jitter 0.05 --error-rate 0.02
+
+The stand-in is served from this process unless `--url` points at one
+that's already running (`python lib/standin.py ...`), which keeps the
+server's work out of the bot's interpreter. Like bench.py, the results can
+be written to a JSON file and compared against another run's.
+"""
+
+##############################################################################
+# Imports
+##############################################################################
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import log_threads
+from lib import metrics, standin
+from lib.okcupid import OkCupid
+from lib.ratelimit import TokenBucket
+from lib.scraper import ScrapePool
+from lib.database import Base, tune_sqlite
+from bench import summarize, format_result, environment, compare, TOLERANCE
+
+##############################################################################
+# Globals
+##############################################################################
+
+CLASSES = ['unreadMessage', 'readMessage']
+
+##############################################################################
+# Functions
+##############################################################################
+
+
+def retrying(fn, attempts):
+    "Call `fn`, trying again up to `attempts` times in all if it raises"
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn()
+        except Exception:
+            if attempt == attempts:
+                raise
+            logging.warning('Attempt %d failed, retrying', attempt,
+                            exc_info=True)
+            metrics.count('loadtest_retries')
+
+
+def scan(bot, pool, session, summaries):
+    """Scrape and ingest the threads in `summaries` that have changed since
+    they were last ingested, with `app.log_threads`
+
+    Returns
+    -------
+    n_threads : int
+        How many were scraped
+    n_messages : int
+        How many new messages were stored
+    """
+    before = metrics.REGISTRY.snapshot()['counters']
+    n_threads = log_threads(bot, [tid for tid, digest in summaries],
+                            dict(summaries), pool=pool, session=session)
+    after = metrics.REGISTRY.snapshot()['counters']
+    return n_threads, (after.get('messages_ingested', 0) -
+                       before.get('messages_ingested', 0))
+
+
+def run(url, n_threads, workers=4, replies=100, rate=1e9, attempts=3,
+        workdir=None):
+    """Scan the inbox on the site at `url`, reply to some of the threads,
+    and scan it again
+
+    Parameters
+    ----------
+    url : str
+        Where the stand-in is, e.g. 'http://127.0.0.1:5000'
+    n_threads : int
+        How many threads it has, to label the results with
+    workers : int
+        Scraping workers
+    replies : int
+        How many threads to reply to between the scans
+    rate : float
+        Requests per second allowed by the rate limiter
+    attempts : int
+        Tries at each page before giving up
+    workdir : str
+        Where to put the database
+
+    Returns
+    -------
+    results : list of dict
+        One per phase, see `bench.summarize`
+    """
+    engine = create_engine('sqlite:///%s' %
+                           os.path.join(workdir, 'loadtest.sqlite'))
+    tune_sqlite(engine)
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+    limiter = TokenBucket(rate=rate, burst=max(workers, 1), jitter=0)
+    bot = OkCupid('okbot', 'password', browser='http', base_url=url + '%s',
+                  limiter=limiter)
+    retrying(bot.login, attempts)
+    pool = ScrapePool.spawn(bot, workers)
+    pool.max_attempts = attempts
+
+    def inbox():
+        return retrying(lambda: bot.get_thread_summaries(CLASSES), attempts)
+
+    results = []
+
+    def record(name, start, items):
+        "One phase, timed from `start`, that handled `items` things"
+        result = summarize(name, n_threads, [time.time() - start],
+                           items_per_call=items)
+        print >>sys.stderr, format_result(result)
+        results.append(result)
+
+    # threads listed per second
+    start = time.time()
+    summaries = inbox()
+    record('loadtest.inbox', start, len(summaries))
+
+    # messages stored per second
+    start = time.time()
+    n_scraped, n_messages = scan(bot, pool, session, summaries)
+    record('loadtest.scrape', start, n_messages)
+
+    start = time.time()
+    to_reply = [tid for tid, digest in summaries[:replies]]
+    for tid in to_reply:
+        retrying(lambda: bot.reply_to_thread(tid, 'hey there'), attempts)
+    record('loadtest.reply', start, len(to_reply))
+
+    # threads checked per second, when only the replied ones have changed
+    start = time.time()
+    n_scraped, n_messages = scan(bot, pool, session, inbox())
+    record('loadtest.rescan', start, len(summaries))
+    if n_scraped != len(to_reply):
+        logging.warning('The rescan scraped %d threads, expected %d',
+                        n_scraped, len(to_reply))
+
+    session.close()
+    return results
+
+
+def report(site=None):
+    "Print the request latency the bot saw, and the stand-in's counters"
+    snapshot = metrics.REGISTRY.snapshot()
+    for name in ('navigate_to', 'scrape_thread', 'reply_to_thread'):
+        phase = snapshot['phases'].get(name)
+        if phase is not None and phase['count'] > 0:
+            print >>sys.stderr, '%-26s %7d  mean %8.3fms' % (
+                name, phase['count'], 1e3 * phase['sum'] / phase['count'])
+    counters = snapshot['counters']
+    print >>sys.stderr, 'pages loaded: %d, retries: %d' % (
+        counters.get('pages_loaded', 0), counters.get('loadtest_retries', 0))
+    if site is not None:
+        print >>sys.stderr, 'stand-in: %s' % json.dumps(site.stats(),
+                                                        sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--threads', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=50,
+                        help='messages per thread')
+    parser.add_argument('--page-size', type=int, default=30,
+                        help='threads per page of the inbox')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the stand-in waits before each response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='up to this many more seconds, at random')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests that fail with a 503')
+    parser.add_argument('--url', help='use the stand-in already running here '
+                        '(its --threads should match)')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='scraping workers')
+    parser.add_argument('--replies', type=int, default=100,
+                        help='threads to reply to between the scans')
+    parser.add_argument('--rate', type=float, default=1e9,
+                        help='requests per second allowed by the rate limiter')
+    parser.add_argument('--attempts', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write the results to this '
+                        'JSON file')
+    parser.add_argument('-c', '--compare', help='compare against the results '
+                        'in this JSON file, exiting with status 1 on a '
+                        'regression')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    # app sets up logging at INFO on import
+    logging.getLogger().setLevel(logging.WARNING)
+    # werkzeug logs every request at INFO unless told otherwise
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    metrics.configure()
+
+    site = server = None
+    url = args.url
+    if url is None:
+        site = standin.Site(args.threads, args.messages,
+                            page_size=args.page_size, seed=args.seed)
+        app = standin.make_app(site, latency=args.latency, jitter=args.jitter,
+                               error_rate=args.error_rate, seed=args.seed)
+        server = standin.serve(app)
+        url = 'http://127.0.0.1:%d' % server.server_port
+
+    workdir = tempfile.mkdtemp(prefix='okbot-loadtest-')
+    try:
+        results = run(url, args.threads, workers=args.workers,
+                      replies=args.replies, rate=args.rate,
+                      attempts=args.attempts, workdir=workdir)
+    finally:
+        shutil.rmtree(workdir)
+        if server is not None:
+            server.shutdown()
+    report(site)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f,
+                      indent=2, sort_keys=True)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if len(compare(baseline, results, args.tolerance)) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()